@@ -1,19 +1,33 @@
+import argparse
+import collections
 import configparser
 import datetime
+import contextlib
+import gc
+import hashlib
+import hmac
+import json
 import logging
+import math
 import sys
 
 import os
+import random
 import re
+import signal
+import threading
 import time
 
 from datetime import timezone, timedelta
 
-import praw
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+try:
+    import zoneinfo
+except ImportError:
+    # python < 3.9 - IANA timezone names and abbreviations aren't supported, only UTC offsets.
+    zoneinfo = None
+
+# NOTE: praw and the google client libraries are imported where they're used.  They're slow to import, and things like
+# --check-title don't need them at all.
 
 # configure script logging
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +36,92 @@ logging.basicConfig(level=logging.INFO)
 COMMON = 'Common'
 REDDIT = 'Reddit'
 GOOGLE = 'Google'
+FEED = 'Feed'
+SYNC = 'Sync'
+MEMORY = 'Memory'
+OUTBOX = 'Outbox'
+LISTING = 'Listing'
+LOGGING = 'Logging'
+CLEANUP = 'Cleanup'
+
+
+# Structured logging.  log_event() logs an event name with key/value fields (post_id, event_id, phase, duration, ...),
+# but does nothing unless the level is enabled - and fields are only turned into strings when the record is formatted,
+# so passing whole jobs or API responses costs nothing at INFO.  High-volume events can be sampled (LOG_SAMPLE_RATES:
+# event -> fraction kept), and output can be JSON (JsonFormatter).  Full API payloads are logged at TRACE, below DEBUG.
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+LOG_SAMPLE_RATES = {}
+
+
+# Log message - formatted on demand.
+class StructuredMessage:
+    __slots__ = ('event', 'message', 'fields')
+
+    def __init__(self, event, message, fields):
+        self.event = event
+        self.message = message
+        self.fields = fields
+
+    def __str__(self):
+        return (self.message + ' ' if self.message else '') + '[' + self.event + ']' + \
+            ''.join(' ' + key + '=' + str(value) for key, value in self.fields.items())
+
+
+# One JSON object per line - structured messages get their event and fields as keys.
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name}
+        if isinstance(record.msg, StructuredMessage):
+            entry['event'] = record.msg.event
+            if record.msg.message:
+                entry['message'] = record.msg.message
+            entry.update(record.msg.fields)
+        else:
+            entry['message'] = record.getMessage()
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def log_event(level, event, message=None, **fields):
+    logger = logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE_RATES.get(event)
+    if rate is not None and random.random() >= rate:
+        return
+    logger.log(level, StructuredMessage(event, message, fields))
+
+
+# Time a block, logging the event with its duration (seconds) once it's done.  Extra fields can be added to the yielded
+# dict along the way.
+@contextlib.contextmanager
+def log_duration(event, level=logging.DEBUG, **fields):
+    start = time.monotonic()
+    try:
+        yield fields
+    finally:
+        log_event(level, event, duration=round(time.monotonic() - start, 3), **fields)
+
+
+# Apply the [Logging] section of the configuration file: level, json (true/false) and sample (event:rate, ...).
+def configure_logging(filename):
+    config = configparser.ConfigParser()
+    config.read(filename)
+
+    root = logging.getLogger()
+    root.setLevel(config.get(LOGGING, 'level', fallback='INFO').upper())
+    if config.getboolean(LOGGING, 'json', fallback=False):
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter())
+
+    LOG_SAMPLE_RATES.clear()
+    for sample in config.get(LOGGING, 'sample', fallback='').split(','):
+        if sample.strip():
+            event, rate = sample.rsplit(':', 1)
+            LOG_SAMPLE_RATES[event.strip()] = float(rate)
 
 
 # Reddit client - use to manipulate Reddit.
@@ -61,6 +161,8 @@ class RedditClient:
     # NOTE: this authentication logic will break if you turn 2FA on for your reddit account.
     # TODO: code for additional scopes.  See https://praw.readthedocs.io/en/latest/tutorials/refresh_token.html
     def authenticate(self):
+        import praw
+
         logging.info("Trying to access reddit...")
         reddit = praw.Reddit(
             client_id=self.client_id,
@@ -72,11 +174,75 @@ class RedditClient:
         logging.info("Authenticated!")
         return reddit
 
-    # retrieve submissions
-    def get_submissions(self, reddit):
+    # retrieve submissions.  Given a listing state, only posts that are new or edited since the last cycle are returned.
+    def get_submissions(self, reddit, listing_state=None):
         # grab our subreddit
         target_subreddit = reddit.subreddit(self.subreddit)
-        return target_subreddit.new(limit=20)
+        if listing_state is None:
+            return target_subreddit.new(limit=20)
+
+        # New posts - everything after the newest post we've seen.  Rescan the latest 20 every so often anyway, in case
+        # that post has gone (reddit returns nothing before a deleted post).
+        submissions = collections.OrderedDict()
+        if listing_state.needs_full_scan():
+            listing = target_subreddit.new(limit=20)
+        else:
+            listing = target_subreddit.new(limit=100, params={'before': listing_state.newest})
+        # oldest first - so if the cycle stops part way, the posts we haven't processed are still after the newest seen.
+        for submission in reversed(list(listing)):
+            submissions[submission.id] = submission
+        logging.info('New submissions: ' + str(len(submissions)))
+
+        # Edited posts - however far down the listing they are.
+        edited = 0
+        for submission in self.get_edited_submissions(reddit, target_subreddit, listing_state):
+            if submission.id not in submissions:
+                submissions[submission.id] = submission
+                edited += 1
+        logging.info('Edited submissions: ' + str(edited))
+
+        listing_state.cycles += 1
+        return list(submissions.values())
+
+    # Posts edited (or re-flaired) since the last cycle.  Moderators can read the subreddit's edited listing; otherwise,
+    # re-check the edited timestamps of the posts we're tracking.  Flair changes (Job Closed, META, ...) aren't edits,
+    # so the tracked posts' flair is checked every cycle either way.
+    def get_edited_submissions(self, reddit, target_subreddit, listing_state):
+        edited = []
+        if listing_state.moderator is not False:
+            try:
+                for item in target_subreddit.mod.edited(only='submissions', limit=100):
+                    if not item.edited or item.edited <= listing_state.last_edit:
+                        break
+                    edited.append(item)
+                listing_state.moderator = True
+                if edited:
+                    # first time through, just note where we're up to - the full scan has the recent posts.  The
+                    # marker only moves on once these have been processed (commit).
+                    first_time = listing_state.last_edit == 0
+                    listing_state.pending_last_edit = max(item.edited for item in edited)
+                    if first_time:
+                        edited = []
+            except Exception as e:
+                logging.info('Unable to read edited listing (not a moderator?) - checking edit times instead. ' +
+                             'Error: ' + str(e))
+                listing_state.moderator = False
+
+        tracked = listing_state.tracked
+        if tracked:
+            check_edits = not listing_state.moderator
+            for submission in reddit.info(fullnames=['t3_' + post_id for post_id in tracked]):
+                if submission.id not in tracked:
+                    continue
+                created, last_edited, flair = tracked[submission.id]
+                if submission.link_flair_text != flair or (check_edits and submission.edited != last_edited):
+                    edited.append(submission)
+        return edited
+
+    # How to address a post's author - their account may have been deleted.
+    @staticmethod
+    def author_name(submission):
+        return '/u/' + submission.author.name if submission.author else 'there'
 
     # translate submission to job
     @staticmethod
@@ -86,7 +252,7 @@ class RedditClient:
         # Create job.
         new_job = Job(
             post_id=submission.id,
-            author=submission.author.name,
+            author=submission.author.name if submission.author else '[deleted]',
             title=submission.title,
             selftext=submission.selftext,
             url=submission.url,
@@ -97,10 +263,10 @@ class RedditClient:
         )
 
         # log it!
-        logging.debug(str(vars(new_job)))
+        log_event(logging.DEBUG, 'job.parsed', post_id=new_job.post_id, job=new_job)
         return new_job
 
-    # Post comment in submission
+    # Post comment in submission.  Returns False if that failed.
     def post_comment(self, submission, text):
         try:
             own_comment = self.find_own_comment(submission)
@@ -117,10 +283,11 @@ class RedditClient:
             else:
                 submission.reply(text)
                 logging.info("Commented on: " + submission.title)
+            return True
 
         except Exception as e:
-            logging.warning("Could not comment in submission: " + submission.title)
-            logging.exception(e)
+            logging.exception("Could not comment in submission: " + submission.id)
+            return False
 
     # Find comment posted by the bot
     def find_own_comment(self, submission):
@@ -131,29 +298,461 @@ class RedditClient:
         return None
 
 
-# Job object - used to describe a scheduled run.
+# Parse cache - memoizes Job parse results across bot cycles.  The same posts get re-read every cycle, so there's no
+# point re-running the regex gauntlet on them.  Keyed on a hash of (title, selftext), each entry holds either the parsed
+# tuple or the parse failure message.  Size bounded (LRU), and optionally persisted to disk so restarts stay warm.  The
+# saved file records the parser version - a file from another version is dropped, so parser fixes take effect.
+class ParseCache:
+    # entry status values
+    PARSED = 'parsed'
+    FAILED = 'failed'
+
+    def __init__(self, max_size=256, filename=None, version=None):
+        self.max_size = max_size
+        self.filename = filename
+        self.version = version
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # cache key - hash of the title and selftext.
+    @staticmethod
+    def key(title, selftext):
+        digest = hashlib.sha1()
+        digest.update((title or '').encode('utf-8'))
+        digest.update(b'\0')
+        digest.update((selftext or '').encode('utf-8'))
+        return digest.hexdigest()
+
+    # Return the parsed tuple for (title, selftext), running parser on a cache miss.  Cached failures are re-raised.
+    def parse(self, title, selftext, parser):
+        key = ParseCache.key(title, selftext)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            try:
+                entry = (ParseCache.PARSED, tuple(parser(title, selftext)))
+            except Exception as e:
+                entry = (ParseCache.FAILED, str(e))
+            self.put(key, entry)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        status, value = entry
+        if status == ParseCache.FAILED:
+            raise Exception(value)
+        return value
+
+    # add entry, evicting the least recently used entries if we're over size.
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'max_size': self.max_size}
+
+    # Load cache entries from disk (if configured).  A missing or broken cache file just means a cold start.
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as cache_file:
+                saved = json.load(cache_file)
+            if not isinstance(saved, dict) or saved.get('version') != self.version:
+                logging.info('Parse cache is from another parser version - dropping: ' + self.filename)
+                os.remove(self.filename)
+                return
+            for key, status, value in saved['entries']:
+                self.put(key, (status, tuple(value) if status == ParseCache.PARSED else value))
+            logging.info('Loaded ' + str(len(self.entries)) + ' parse cache entries from: ' + self.filename)
+        except Exception as e:
+            logging.warning('Unable to load parse cache: ' + self.filename + '. Error: ' + str(e))
+            self.entries.clear()
+
+    # Save cache entries to disk (if configured).  Write to a temporary file and swap, so a crash can't corrupt it.
+    def save(self):
+        if not self.filename:
+            return
+        try:
+            temp_filename = self.filename + '.tmp'
+            with open(temp_filename, 'w') as cache_file:
+                json.dump({'version': self.version,
+                           'entries': [[key, status, value] for key, (status, value) in self.entries.items()]},
+                          cache_file)
+            os.replace(temp_filename, self.filename)
+        except Exception as e:
+            logging.warning('Unable to save parse cache: ' + self.filename + '. Error: ' + str(e))
+
+
+# Resolved timezone - tzinfo to build date/times with, and the timezone name we send to Google.
+ResolvedTimezone = collections.namedtuple('ResolvedTimezone', ['tzinfo', 'google_name'])
+
+
+# Timezone resolver - maps the raw timezone strings GMs put in their posts (UTC offsets, abbreviations, IANA names) to a
+# tzinfo and to a timezone name Google accepts.  Results are memoized - we see the same handful of strings every cycle.
+class TimezoneResolver:
+    # UTC+10, UTC-6, UTC-0600, UTC+05:30, etc.
+    OFFSET_PATTERN = re.compile("[Uu][Tt][Cc]([+-])([01]?[0-9]):?([0-5][0-9])?")
+
+    # Common abbreviations.  People write EST in July, so these map onto the region, not the fixed offset.
+    ABBREVIATIONS = {
+        'UTC': 'UTC', 'GMT': 'UTC', 'Z': 'UTC',
+        'BST': 'Europe/London',
+        'CET': 'Europe/Berlin', 'CEST': 'Europe/Berlin',
+        'EET': 'Europe/Helsinki', 'EEST': 'Europe/Helsinki',
+        'ET': 'America/New_York', 'EST': 'America/New_York', 'EDT': 'America/New_York',
+        'CT': 'America/Chicago', 'CST': 'America/Chicago', 'CDT': 'America/Chicago',
+        'MT': 'America/Denver', 'MST': 'America/Denver', 'MDT': 'America/Denver',
+        'PT': 'America/Los_Angeles', 'PST': 'America/Los_Angeles', 'PDT': 'America/Los_Angeles',
+        'AWST': 'Australia/Perth',
+        'ACST': 'Australia/Adelaide', 'ACDT': 'Australia/Adelaide',
+        'AEST': 'Australia/Sydney', 'AEDT': 'Australia/Sydney',
+        'NZST': 'Pacific/Auckland', 'NZDT': 'Pacific/Auckland',
+        'JST': 'Asia/Tokyo',
+        'IST': 'Asia/Kolkata',
+    }
+
+    UTC = ResolvedTimezone(timezone.utc, 'UTC')
+
+    # memo table: raw timezone string -> ResolvedTimezone (None if unknown).  Bounded - it's fed from user input.
+    MAX_SIZE = 256
+    resolved = {}
+
+    # Resolve the raw timezone string.  Unknown timezones resolve to UTC.
+    @classmethod
+    def resolve(cls, tz_str):
+        resolved = cls.lookup(tz_str)
+        if resolved is None:
+            return TimezoneResolver.UTC
+        return resolved
+
+    # Return True if the raw timezone string is one we understand.  (Used to probe title words - no warnings.)
+    @classmethod
+    def is_known(cls, tz_str):
+        return cls.lookup(tz_str, warn=False) is not None
+
+    # Memoized resolution - returns None for unknown timezones, warning the first time one is seen.
+    @classmethod
+    def lookup(cls, tz_str, warn=True):
+        try:
+            return cls.resolved[tz_str]
+        except KeyError:
+            pass
+
+        resolved = cls.resolve_uncached(tz_str)
+        if resolved is None and warn:
+            logging.warning('Unknown timezone: ' + str(tz_str) + ' - using UTC.')
+        if len(cls.resolved) >= cls.MAX_SIZE:
+            cls.resolved.clear()
+        cls.resolved[tz_str] = resolved
+        return resolved
+
+    @classmethod
+    def resolve_uncached(cls, tz_str):
+        if not tz_str:
+            return None
+
+        # UTC offset.
+        m = TimezoneResolver.OFFSET_PATTERN.fullmatch(tz_str)
+        if m:
+            sign = -1 if m.group(1) == '-' else 1
+            hours = int(m.group(2))
+            minutes = int(m.group(3) or 0)
+            tz = timezone(sign * timedelta(hours=hours, minutes=minutes))
+
+            # Google wants an IANA name.  Whole-hour offsets have an Etc/GMT zone (with the sign flipped - POSIX!).
+            # Anything else is sent to Google as UTC.
+            if minutes == 0 and (hours == 0 or (sign > 0 and hours <= 14) or (sign < 0 and hours <= 12)):
+                google_name = 'UTC' if hours == 0 else 'Etc/GMT' + ('-' if sign > 0 else '+') + str(hours)
+            else:
+                google_name = 'UTC'
+            return ResolvedTimezone(tz, google_name)
+
+        # Abbreviation or IANA name.
+        name = TimezoneResolver.ABBREVIATIONS.get(tz_str.upper(), tz_str)
+        if name == 'UTC':
+            return TimezoneResolver.UTC
+        if zoneinfo is None or '/' not in name:
+            return None
+        try:
+            return ResolvedTimezone(zoneinfo.ZoneInfo(name), name)
+        except Exception:
+            return None
+
+
+# Listing state - where we're up to in the subreddit, so each cycle only reads new and edited posts.  Persisted so
+# restarts pick up where they left off.
+class ListingState:
+    def __init__(self, filename=None, full_scan_every=12, track_days=14, max_tracked=500):
+        self.filename = filename
+        self.full_scan_every = full_scan_every
+        self.track_days = track_days
+        self.max_tracked = max_tracked
+
+        self.newest = None          # fullname of the newest post seen
+        self.newest_created = 0
+        self.last_edit = 0          # newest edit time seen in the moderator edited listing
+        self.pending_last_edit = 0  # ... read this cycle, but not yet processed
+        self.moderator = None       # None - don't know yet
+        self.tracked = {}           # post id -> [created_utc, edited, flair] - recent posts, for edit/flair checks
+        self.cycles = 0
+
+    @classmethod
+    def from_file(cls, filename, state_filename):
+        config = configparser.ConfigParser()
+        config.read(filename)
+        return cls(
+            state_filename,
+            config.getint(LISTING, 'full_scan_every', fallback=12),
+            config.getint(LISTING, 'track_days', fallback=14),
+            config.getint(LISTING, 'max_tracked', fallback=500)
+        )
+
+    def needs_full_scan(self):
+        return self.newest is None or self.cycles % self.full_scan_every == 0
+
+    # Everything read this cycle has been processed.
+    def commit(self):
+        self.last_edit = max(self.last_edit, self.pending_last_edit)
+
+    # Record a post we've read.
+    def saw(self, submission):
+        if submission.created_utc > self.newest_created:
+            self.newest = submission.fullname
+            self.newest_created = submission.created_utc
+        self.tracked[submission.id] = [submission.created_utc, submission.edited, submission.link_flair_text]
+
+        # stop tracking old posts - and the oldest, if we're tracking too many.
+        cutoff = time.time() - self.track_days * 24 * 60 * 60
+        if len(self.tracked) > self.max_tracked or min(entry[0] for entry in self.tracked.values()) < cutoff:
+            by_created = sorted(self.tracked, key=lambda post_id: self.tracked[post_id][0])
+            for post_id in by_created[:max(0, len(self.tracked) - self.max_tracked)]:
+                del self.tracked[post_id]
+            for post_id in [post_id for post_id, entry in self.tracked.items() if entry[0] < cutoff]:
+                del self.tracked[post_id]
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as state_file:
+                state = json.load(state_file)
+            self.newest = state['newest']
+            self.newest_created = state['newest_created']
+            self.last_edit = state['last_edit']
+            self.moderator = state['moderator']
+            self.cycles = state.get('cycles', 0)
+            # entries from before flair was tracked - the flair's unknown, so they'll be re-checked once.
+            self.tracked = {post_id: (entry + [None])[:3] for post_id, entry in state['tracked'].items()}
+        except Exception as e:
+            logging.warning('Unable to load listing state: ' + self.filename + ' - starting afresh. Error: ' + str(e))
+
+    def save(self):
+        if not self.filename:
+            return
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as state_file:
+            json.dump({'newest': self.newest, 'newest_created': self.newest_created, 'last_edit': self.last_edit,
+                       'moderator': self.moderator, 'tracked': self.tracked, 'cycles': self.cycles}, state_file)
+        os.replace(temp_filename, self.filename)
+
+
+# Cleanup schedule - orphan cleanup as a rolling sweep.  Rather than listing every future event and checking it against
+# reddit every cycle, we keep an index of the calendar's events (cleanup.json), refreshed with just what's changed since
+# the last cycle (Google sync tokens), and each cycle checks a slice of it: the events most overdue for a check.  How
+# often an event is due depends on how soon it starts (a quarter of the time until it starts, between
+# min_interval_minutes and full_pass_hours), so imminent runs are checked often, and every event is checked at least
+# once per full_pass_hours.  The slice is sized from the index and the time between cycles to keep up with that,
+# between per_cycle and max_per_cycle - so the cost of a cycle is bounded however big the calendar gets.  If that's not
+# enough to keep up, we say so rather than check more.
+class CleanupSchedule:
+    # Assumed time between cycles, until we've seen two.
+    DEFAULT_CYCLE_SECONDS = 5 * 60
+
+    def __init__(self, filename=None, per_cycle=10, full_pass_hours=24, min_interval_minutes=15, max_per_cycle=50):
+        self.filename = filename
+        self.per_cycle = per_cycle
+        self.max_per_cycle = max_per_cycle
+        self.full_pass_seconds = full_pass_hours * 60 * 60
+        self.min_interval_seconds = min_interval_minutes * 60
+
+        self.sync_token = None      # Google sync token - None until the first (full) sync
+        self.events = {}            # event id -> {id, summary, start, extendedProperties} - bot events in the calendar
+        self.last_verified = {}     # post id -> when we last checked its reddit post
+        self.last_run = None        # when we last picked a slice
+
+    @classmethod
+    def from_file(cls, filename, state_filename):
+        config = configparser.ConfigParser()
+        config.read(filename)
+        return cls(
+            state_filename,
+            config.getint(CLEANUP, 'per_cycle', fallback=10),
+            config.getfloat(CLEANUP, 'full_pass_hours', fallback=24),
+            config.getfloat(CLEANUP, 'min_interval_minutes', fallback=15),
+            config.getint(CLEANUP, 'max_per_cycle', fallback=50)
+        )
+
+    # When an event starts (timestamp).
+    @staticmethod
+    def start_time(event):
+        return EventFeed.parse_datetime(event['start']['dateTime']).timestamp()
+
+    # Bring the index up to date with the calendar.  Returns the bot events that were added or changed.
+    def refresh(self, google_client):
+        events, self.sync_token, full = google_client.sync_events(self.sync_token)
+        if full:
+            self.events = {}
+
+        changed = []
+        for event in events:
+            post_id = event.get('extendedProperties', {}).get('private', {}).get('redditPost')
+            if event.get('status') == 'cancelled' or post_id is None or 'dateTime' not in event.get('start', {}):
+                self.events.pop(event['id'], None)
+                continue
+            self.events[event['id']] = {
+                'id': event['id'],
+                'summary': event.get('summary', ''),
+                'start': {'dateTime': event['start']['dateTime']},
+                'extendedProperties': {'private': {'redditPost': post_id}},
+            }
+            changed.append(event)
+        return changed
+
+    # Pick the events to check this cycle, most overdue first.
+    def select(self, now):
+        # drop events that have started - and forget posts we no longer have events for.
+        for event_id in [event_id for event_id, event in self.events.items()
+                         if CleanupSchedule.start_time(event) < now]:
+            del self.events[event_id]
+        post_ids = set(event['extendedProperties']['private']['redditPost'] for event in self.events.values())
+        for post_id in [post_id for post_id in self.last_verified if post_id not in post_ids]:
+            del self.last_verified[post_id]
+
+        cycle_seconds = CleanupSchedule.DEFAULT_CYCLE_SECONDS if self.last_run is None else \
+            min(max(now - self.last_run, 60), self.full_pass_seconds)
+        self.last_run = now
+
+        due = []
+        checks_per_second = 0
+        for event in self.events.values():
+            start = CleanupSchedule.start_time(event)
+            interval = min(max((start - now) / 4, self.min_interval_seconds), self.full_pass_seconds)
+            checks_per_second += 1 / interval
+            due_time = self.last_verified.get(event['extendedProperties']['private']['redditPost'], 0) + interval
+            if due_time <= now:
+                due.append((due_time, start, event))
+        due.sort(key=lambda entry: (entry[0], entry[1]))
+
+        # enough checks per cycle to keep every event within its interval.
+        needed = math.ceil(checks_per_second * cycle_seconds)
+        slice_size = min(max(self.per_cycle, needed), self.max_per_cycle)
+        if needed > self.max_per_cycle:
+            logging.warning('Orphan cleanup needs ' + str(needed) + ' checks a cycle to keep up with ' +
+                            str(len(self.events)) + ' events, but [Cleanup] max_per_cycle is ' +
+                            str(self.max_per_cycle) + ' - a full pass will take longer than full_pass_hours.')
+
+        # falling behind?  (a never-checked event isn't behind, just new)
+        if len(due) > slice_size and 0 < due[0][0] < now - self.full_pass_seconds:
+            logging.warning('Orphan cleanup is behind - ' + str(len(due)) + ' events due.')
+
+        return [event for due_time, start, event in due[:slice_size]]
+
+    def mark_verified(self, post_id, now):
+        self.last_verified[post_id] = now
+
+    # The post's events have been deleted.
+    def forget(self, post_id):
+        self.last_verified.pop(post_id, None)
+        for event_id in [event_id for event_id, event in self.events.items()
+                         if event['extendedProperties']['private']['redditPost'] == post_id]:
+            del self.events[event_id]
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as state_file:
+                state = json.load(state_file)
+            self.sync_token = state['sync_token']
+            self.events = state['events']
+            self.last_verified = state['last_verified']
+            self.last_run = state['last_run']
+        except Exception as e:
+            logging.warning('Unable to load cleanup schedule: ' + self.filename + ' - starting afresh. Error: ' +
+                            str(e))
+            self.sync_token = self.last_run = None
+            self.events = {}
+            self.last_verified = {}
+
+    def save(self):
+        if not self.filename:
+            return
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as state_file:
+            json.dump({'sync_token': self.sync_token, 'events': self.events, 'last_verified': self.last_verified,
+                       'last_run': self.last_run}, state_file)
+        os.replace(temp_filename, self.filename)
+
+
+# Job object - used to describe a scheduled run.  Slotted, and the selftext is dropped once parsed, as we can hold a lot
+# of these in memory.
 class Job:
+    __slots__ = ('title', 'post_id', 'author', 'url', 'permalink', 'created_utc', 'flair', 'edited', 'metaplot',
+                 'name_of_run', 'year', 'month', 'day', 'hour', 'minute', 'timezone', '_start_datetime')
+
+    # Title parsers: (name, pattern, parse method), tried in order.
+    TITLE_PARSERS = (
+        # yyyy-mm-dd
+        ('yyyy-mm-dd', re.compile('(.+?)(\d{4})[-\.\s]+(\d{1,2})[-\.\s]+(\d{1,2})(.*)'), 'parse_anchor_on_short_date'),
+        # 202ymmdd - NOTE: this will fail in 2030. Usability tax. :)
+        ('yyyymmdd', re.compile('(.+?)(202\d)(\d{2})(\d{2})(.*)'), 'parse_anchor_on_short_date'),
+        # dd-mm-yyyy
+        ('dd-mm-yyyy', re.compile('(.+?)(\d{1,2})[-\.\s]+(\d{1,2})[-\.\s]+(\d{4})(.*)'),
+         'parse_anchor_on_short_date_reversed'),
+        # ddmm202y - NOTE: this will fail in 2030. Usability tax. :)
+        ('ddmmyyyy', re.compile('(.+?)(\d{2})(\d{2})(202\d)(.*)'), 'parse_anchor_on_short_date_reversed'),
+    )
+
+    # Calendar hint in the selftext: {CALENDAR_HINT: <Title>}
+    CALENDAR_HINT_PATTERN = re.compile('.*{CALENDAR.*HINT:(.*)}.*', re.MULTILINE)
+
+    # Bump whenever parsing changes, so saved parse caches are dropped.
+    PARSER_VERSION = 2
+
+    # Parse results shared across all jobs (and bot cycles).  Set to None to disable caching.
+    parse_cache = ParseCache()
 
     def __init__(self, title=None, post_id=None, author=None, selftext=None, url=None, permalink=None, created_utc=None,
                  flair=None, edited=None):
         self.title = title
         self.post_id = post_id
         self.author = author
-        self.selftext = selftext
         self.url = url
         self.permalink = permalink
         self.created_utc = created_utc
         self.flair = flair
         self.edited = edited
 
-        try:
-            # Parse CALENDAR HINT first (if present).  This allows the hint to override the title - for whatever reason.
-            self.metaplot, self.name_of_run, self.year, self.month, self.day, self.hour, self.minute, self.timezone = \
-                Job.parse_selftext(selftext)
-        except Exception:
-            # Parse title.
-            self.metaplot, self.name_of_run, self.year, self.month, self.day, self.hour, self.minute, self.timezone = \
-                Job.parse_title(title)
+        if Job.parse_cache is not None:
+            parsed = Job.parse_cache.parse(title, selftext, Job.parse)
+        else:
+            parsed = Job.parse(title, selftext)
+        self.metaplot, self.name_of_run, self.year, self.month, self.day, self.hour, self.minute, self.timezone = parsed
+
+        # derived fields - computed on first use.
+        self._start_datetime = None
+
+    def __repr__(self):
+        return 'Job(' + ', '.join(name + '=' + repr(getattr(self, name)) for name in Job.__slots__
+                                  if not name.startswith('_')) + ')'
 
     # getter - handle None values
     def get_flair(self):
@@ -162,50 +761,73 @@ class Job:
         else:
             return self.flair
 
+    @classmethod
+    def parse(cls, title, selftext):
+        return Job.parse_explained(title, selftext)[2]
+
+    # As parse(), but also reports where the result came from: ('hint' or 'title', parser name, parsed tuple).
+    @classmethod
+    def parse_explained(cls, title, selftext):
+        # Parse CALENDAR HINT first (if present).  This allows the hint to override the title - for whatever reason.
+        hint = Job.find_calendar_hint(selftext)
+        if hint is not None:
+            try:
+                return ('hint',) + Job.match_title(hint)
+            except Exception as e:
+                log_event(logging.DEBUG, 'parse.hint_failed', 'unable to parse calendar hint - falling back to title.',
+                          error=e)
+
+        # Parse title.
+        return ('title',) + Job.match_title(title)
+
     @classmethod
     def parse_title(cls, title):
-        logging.debug('parse title: ' + title)
+        return Job.match_title(title)[1]
+
+    # Parse the title, returning (parser name, parsed tuple).
+    @classmethod
+    def match_title(cls, title):
+        log_event(logging.DEBUG, 'parse.title', title=title)
 
         # Format is supposed to be: '[Metaplot, if any] Name of Run. Year-Month-Day. Time UTC'
         # Actual format is all-over-the-place.  Humans - bah!  Anchor on the date component, and go from there.
         # To cater for this, I've put in an extensible parsing mechanism to cater for completely different regex's.
-
-        parsers = {
-            # yyyy-mm-dd
-            '(.+?)(\d{4})[-\.\s]+(\d{1,2})[-\.\s]+(\d{1,2})(.*)': Job.parse_anchor_on_short_date,
-            # 202ymmdd - NOTE: this will fail in 2030. Usability tax. :)
-            '(.+?)(202\d)(\d{2})(\d{2})(.*)': Job.parse_anchor_on_short_date,
-            # dd-mm-yyyy
-            '(.+?)(\d{1,2})[-\.\s]+(\d{1,2})[-\.\s]+(\d{4})(.*)': Job.parse_anchor_on_short_date_reversed,
-            # ddmm202y - NOTE: this will fail in 2030. Usability tax. :)
-            '(.+?)(\d{2})(\d{2})(202\d)(.*)': Job.parse_anchor_on_short_date_reversed,
-        }
-
-        for key, value in parsers.items():
-            p = re.compile(key)
-            m = p.match(title)
+        for name, pattern, parser in Job.TITLE_PARSERS:
+            m = pattern.match(title)
             if m:
-                result = value(m)
+                result = getattr(Job, parser)(m)
                 if result is not None:
-                    return result
+                    return name, result
 
         # no match
         raise Exception('Unable to parse time/date in title: ' + title)
 
     @classmethod
     def parse_selftext(cls, selftext):
-        logging.debug('parse selfText: ' + selftext)
+        log_event(TRACE, 'parse.selftext', selftext=selftext)
 
-        # Find calendar hint: {CALENDAR_HINT: <Title>}
-        m = re.search('.*{CALENDAR.*HINT:(.*)}.*', selftext, re.MULTILINE)
-        if m:
-            hint = m.group(1)
-            logging.debug('found hint: ' + hint)
+        hint = Job.find_calendar_hint(selftext)
+        if hint is not None:
             return Job.parse_title(hint)
 
         # no match
         raise Exception('Unable to find/parse calendar hint in selfText.')
 
+    # Return the calendar hint in the selftext, or None if there isn't one.  Most posts don't have a hint, so this
+    # doesn't raise.
+    @classmethod
+    def find_calendar_hint(cls, selftext):
+        if not selftext:
+            return None
+
+        m = Job.CALENDAR_HINT_PATTERN.search(selftext)
+        if m:
+            hint = m.group(1)
+            log_event(logging.DEBUG, 'parse.hint', hint=hint)
+            return hint
+
+        return None
+
     @classmethod
     def parse_name_fragment(cls, name_fragment):
         # look for optional metaplot.  If not found - the whole thing is a name.
@@ -223,6 +845,11 @@ class Job:
         if m:
             return int(m.group(1)), int(m.group(2)), m.group(3).strip()
 
+        # Named timezone - abbreviation or IANA name.  Only if we recognise it - otherwise it's just more title.
+        m = re.compile(r'[^\d]*(\d{1,2}):?(\d\d)\s+([A-Za-z]+(?:/[A-Za-z_+\-]+)*)').match(time_fragment)
+        if m and TimezoneResolver.is_known(m.group(3)):
+            return int(m.group(1)), int(m.group(2)), m.group(3)
+
         # No timezone
         m = re.compile('[^\d]*(\d{1,2}):?(\d\d)[^\d]*').match(time_fragment)
         if m:
@@ -251,29 +878,22 @@ class Job:
         hour, minute, timezone = Job.parse_time_fragment(m.group(5))
         return metaplot, name_of_run, year, month, day, hour, minute, timezone
 
-    # Return datetime object representing internal date/time state.
-    # TODO: this will always ignore the timezone value and will hardcode UTC.  Expand!
+    # Return datetime object representing internal date/time state.  Computed once - the date/time fields don't change
+    # after parsing.
     def get_start_datetime(self):
-        dt = datetime.datetime(self.year, self.month, self.day, self.hour, self.minute, 0, 0, tzinfo=timezone.utc)
-        hours, min = Job.parse_timezone_offset_values(self.timezone)
-        td = timedelta(hours=hours, minutes=min)
-        tz = timezone(td)
-        dt = dt.replace(tzinfo=tz)
-        return dt
-
-    # Return the hours and minutes
-    @classmethod
-    def parse_timezone_offset_values(cls, tz_str):
-        m = re.compile("[Uu][Tt][Cc]([+-][01]?[0-9]):?([0-5][0-9])?").match(tz_str)
-        if m:
-            hour = m.group(1)
-            minute = m.group(2)
-            if not minute:
-                minute = 0
-            return int(hour), int(minute)
+        if self._start_datetime is None:
+            tz = TimezoneResolver.resolve(self.timezone).tzinfo
+            self._start_datetime = datetime.datetime(self.year, self.month, self.day, self.hour, self.minute, 0, 0,
+                                                     tzinfo=tz)
+        return self._start_datetime
+
+    # Return the timezone name to send to Google.
+    def get_google_timezone(self):
+        return TimezoneResolver.resolve(self.timezone).google_name
 
-        # no offset
-        return 0,0
+    # Return the job's UTC offset (timedelta).
+    def get_utc_offset(self):
+        return self.get_start_datetime().utcoffset()
 
 
 # Google client - use to manipulate Google's calendar.
@@ -315,6 +935,10 @@ class GoogleClient:
         """Shows basic usage of the Google Calendar API.
         Prints the start and name of the next 10 events on the user's calendar.
         """
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         creds = None
         # The file credentials.json stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first
@@ -339,6 +963,8 @@ class GoogleClient:
 
     # authenticate bot to google
     def authenticate(self, creds):
+        from googleapiclient.discovery import build
+
         self.service = build('calendar', 'v3', credentials=creds)
         return self.service
 
@@ -346,6 +972,10 @@ class GoogleClient:
     def build_event_json(self, job):
         # Builds the JSON block for Google from the Job contents
         start_datetime = job.get_start_datetime()
+        google_timezone = job.get_google_timezone()
+        if google_timezone == 'UTC':
+            # Covers offsets Google has no zone for (eg. UTC+05:30) - send the UTC time.
+            start_datetime = start_datetime.astimezone(timezone.utc)
         end_datetime = start_datetime + datetime.timedelta(hours=3)  # TODO - parse run length from the run text, maybe.
 
         eventJson = {
@@ -354,11 +984,11 @@ class GoogleClient:
             'description': 'https://reddit.com' + job.permalink + ' by ' + job.author,
             'start': {
                 'dateTime': start_datetime.strftime(GoogleClient.DATE_TIME_FORMAT),
-                'timeZone': job.timezone
+                'timeZone': google_timezone
             },
             'end': {
                 'dateTime': end_datetime.strftime(GoogleClient.DATE_TIME_FORMAT),
-                'timeZone': job.timezone
+                'timeZone': google_timezone
             },
             'extendedProperties': {
                 # Allow us to search on event given reddit post id.
@@ -370,29 +1000,39 @@ class GoogleClient:
                 }
             }
         }
+        eventJson['extendedProperties']['private']['jobFingerprint'] = GoogleClient.fingerprint(eventJson)
         return eventJson
 
+    # Cheap fingerprint of an event body (less the fingerprint itself) - if it matches, the event is up to date.
+    @staticmethod
+    def fingerprint(eventJson):
+        private = dict(eventJson['extendedProperties']['private'])
+        private.pop('jobFingerprint', None)
+        body = dict(eventJson, extendedProperties=dict(eventJson['extendedProperties'], private=private))
+        return hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
     # insert event into Calendar
     def create_event(self, job):
-        logging.debug('creating event for post_id: ' + str(job.post_id))
         eventJson = self.build_event_json(job)
-        response = self.service.events() \
-            .insert(calendarId=self.calendar_id, body=eventJson).execute()
-        logging.debug('Response: ' + str(response))
+        with log_duration('google.insert', post_id=job.post_id) as fields:
+            response = self.service.events() \
+                .insert(calendarId=self.calendar_id, body=eventJson).execute()
+            fields['event_id'] = response.get('id')
+        log_event(TRACE, 'google.response', post_id=job.post_id, response=response)
 
     # find event in calendar using the private properties (reddit post id).
     def find_all_events(self, post_id):
-        logging.debug('finding all events for post_id: ' + str(post_id))
-        events_response = self.service.events().list(calendarId=self.calendar_id,
-                                                     privateExtendedProperty='redditPost=' + str(post_id)).execute()
-        logging.debug('Response: ' + str(events_response))
+        with log_duration('google.find', post_id=post_id) as fields:
+            events_response = self.service.events().list(calendarId=self.calendar_id,
+                                                         privateExtendedProperty='redditPost=' + str(post_id)).execute()
+            fields['found'] = len(events_response.get('items', []))
+        log_event(TRACE, 'google.response', post_id=post_id, response=events_response)
         events = events_response.get('items', [])
         # TODO - error handling
         return events
 
     # find event in calendar using the private properties (reddit post id).
     def find_event(self, post_id):
-        logging.debug('finding event for post_id: ' + str(post_id))
         events = self.find_all_events(post_id)
         if events is not None and len(events) > 0:
             return events[0]
@@ -402,51 +1042,405 @@ class GoogleClient:
     # find future events in calendar.
     def find_future_events(self, dt_from):
         dt_from_string = dt_from.strftime(GoogleClient.DATE_TIME_FORMAT) + 'Z'
-        logging.debug('finding all events after: ' + dt_from_string)
-        events_response = self.service.events().list(calendarId=self.calendar_id, timeMin=dt_from_string,
-                                                     maxResults=50, singleEvents=True, orderBy='startTime').execute()
-        logging.debug('Response: ' + str(events_response))
+        with log_duration('google.find_future', time_min=dt_from_string) as fields:
+            events_response = self.service.events().list(calendarId=self.calendar_id, timeMin=dt_from_string,
+                                                         maxResults=50, singleEvents=True,
+                                                         orderBy='startTime').execute()
+            fields['found'] = len(events_response.get('items', []))
+        log_event(TRACE, 'google.response', response=events_response)
         events = events_response.get('items', [])
         # TODO - error handling
         return events
 
+    # Events changed since the sync token (or all events, with no token).  Returns (events, next sync token, full) -
+    # full is True if this is every event (no token, or Google expired it), not just the changes.  Deleted events
+    # come back with status 'cancelled'.
+    def sync_events(self, sync_token=None):
+        events = []
+        page_token = None
+        while True:
+            try:
+                with log_duration('google.sync', full=sync_token is None) as fields:
+                    events_response = self.service.events().list(calendarId=self.calendar_id, syncToken=sync_token,
+                                                                 maxResults=250, pageToken=page_token).execute()
+                    fields['found'] = len(events_response.get('items', []))
+            except Exception as e:
+                # 410 Gone - the sync token has expired.  Start over.
+                if sync_token is None or getattr(getattr(e, 'resp', None), 'status', None) != 410:
+                    raise
+                logging.info('Calendar sync token expired - resyncing all events.')
+                events, sync_token, page_token = [], None, None
+                continue
+            log_event(TRACE, 'google.response', response=events_response)
+            events.extend(events_response.get('items', []))
+
+            page_token = events_response.get('nextPageToken')
+            if not page_token:
+                return events, events_response.get('nextSyncToken'), sync_token is None
+
     # Update event (if required)
     def update_event(self, event, job):
         # Event ID
         event_id = event['id']
 
-        # Check to see if event has changed.  Check for flair change or start change.
+        # Check to see if event has changed.  Events we've written carry the job fingerprint - compare that.
+        eventJson = self.build_event_json(job)
+        fingerprint = event.get('extendedProperties', {}).get('private', {}).get('jobFingerprint')
+        if fingerprint is not None:
+            is_changed = fingerprint != eventJson['extendedProperties']['private']['jobFingerprint']
+
+        # Older events - check for flair change or start change.
         # TODO - "not in" instead of != as google adds Z (Zulu/local).  I might have coded incorrectly in GoogleClient.authenticate() - though it works.  Check.
-        is_changed = \
-            job.get_flair().upper() not in event['summary'] or \
-            job.get_start_datetime().strftime(GoogleClient.DATE_TIME_FORMAT) not in event['start']['dateTime'] or \
-            job.timezone not in event['start']['timeZone']
+        else:
+            start = eventJson['start']
+            is_changed = \
+                job.get_flair().upper() not in event['summary'] or \
+                start['dateTime'] not in event['start']['dateTime'] or \
+                start['timeZone'] != event['start'].get('timeZone')
 
         # If something's changed, go ahead and update the calendar event.
         if (is_changed):
             logging.info("Updating event: " + event_id)
-            eventJson = self.build_event_json(job)
-            response = self.service.events() \
-                .update(calendarId=self.calendar_id, eventId=event_id, body=eventJson).execute()
+            with log_duration('google.update', post_id=job.post_id, event_id=event_id):
+                response = self.service.events() \
+                    .update(calendarId=self.calendar_id, eventId=event_id, body=eventJson).execute()
+            log_event(TRACE, 'google.response', post_id=job.post_id, event_id=event_id, response=response)
             return response
 
         # No need to update.
         logging.info('Updating event: ' + event_id + ' skipping event update - no change required.')
         return None
 
+    # Write an event body: update the given event, or - with no event id - the post's existing event.  Creates the
+    # event if there isn't one.  Safe to repeat.
+    def write_event(self, post_id, body, event_id=None):
+        if event_id is None:
+            event = self.find_event(post_id)
+            event_id = event['id'] if event else None
+
+        if event_id is None:
+            with log_duration('google.insert', post_id=post_id):
+                return self.service.events().insert(calendarId=self.calendar_id, body=body).execute()
+
+        with log_duration('google.update', post_id=post_id, event_id=event_id):
+            return self.service.events().update(calendarId=self.calendar_id, eventId=event_id, body=body).execute()
+
     # find all events with the given post_id and delete it
     def delete_event(self, post_id):
         # find event(s)
         events = self.find_all_events(post_id)
-        logging.debug('event: ' + str(events))
 
         # delete them - clean out any duplicates if found (from bot failures, dodgy data, etc).
         if events is not None:
             for event in events:
-                logging.debug('deleting event for post_id: ' + str(post_id))
-                response = self.service.events(). \
-                    delete(calendarId=self.calendar_id, eventId=event['id']).execute()
-                logging.debug('response: ' + str(response))
+                with log_duration('google.delete', post_id=post_id, event_id=event['id']):
+                    self.service.events(). \
+                        delete(calendarId=self.calendar_id, eventId=event['id']).execute()
+
+
+# Event feed - a local .ics file (and optionally a JSON feed) mirroring the calendar events the bot writes, built from
+# the same data as GoogleClient.build_event_json.  Serve it from a web server or file share, and readers don't need to
+# touch the Google API at all.  Only changed events are re-rendered, and the files are only rewritten if something
+# changed (atomically - readers never see a partial file).
+class EventFeed:
+    ICS_DATE_TIME_FORMAT = '%Y%m%dT%H%M%SZ'
+
+    def __init__(self, ics_filename, json_filename=None, calendar_name='Job Calendar', keep_days=30, max_events=1000):
+        self.ics_filename = ics_filename
+        self.json_filename = json_filename
+        self.state_filename = ics_filename + '.state.json'
+        self.calendar_name = calendar_name
+        self.keep_days = keep_days
+        self.max_events = max_events
+
+        # post id -> {fingerprint, start, end, event (JSON feed entry), vevent (rendered ics block)}
+        self.entries = {}
+        self.dirty = False
+
+    # Returns None if no feed is configured.
+    @classmethod
+    def from_file(cls, filename):
+        config = configparser.ConfigParser()
+        config.read(filename)
+        if not config.has_option(FEED, 'ics_file'):
+            return None
+        return cls(
+            config.get(FEED, 'ics_file'),
+            config.get(FEED, 'json_file', fallback=None),
+            config.get(FEED, 'calendar_name', fallback=config.get(COMMON, 'subreddit_name') + ' Job Calendar'),
+            config.getint(FEED, 'keep_days', fallback=30),
+            config.getint(FEED, 'max_events', fallback=1000)
+        )
+
+    def load(self):
+        if not os.path.exists(self.state_filename):
+            return
+        try:
+            with open(self.state_filename, 'r') as state_file:
+                self.entries = json.load(state_file)
+        except Exception as e:
+            logging.warning('Unable to load event feed state: ' + self.state_filename + '. Error: ' + str(e))
+            self.entries = {}
+        # rewrite the feed on the next save, whatever state we started from.
+        self.dirty = True
+
+    # Add or refresh the event for the given job.  event_json is what we sent (or would send) to Google.
+    def update(self, job, event_json):
+        post_id = str(job.post_id)
+        fingerprint = event_json['extendedProperties']['private']['jobFingerprint']
+        entry = self.entries.get(post_id)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            return
+
+        start = job.get_start_datetime().astimezone(timezone.utc)
+        self.put(post_id, fingerprint, event_json, start, start + datetime.timedelta(hours=3))
+
+    # Add or refresh the entry for an event already in the calendar (as listed by Google) - so events created before
+    # the feed was set up, or for posts we haven't re-read since, are in the feed too.
+    def update_from_event(self, event):
+        private = event.get('extendedProperties', {}).get('private', {})
+        post_id = private.get('redditPost')
+        if post_id is None or 'dateTime' not in event['start']:
+            return
+
+        # events written before fingerprints existed - take them once, then leave them to update().
+        fingerprint = private.get('jobFingerprint')
+        entry = self.entries.get(post_id)
+        if entry is not None and (fingerprint is None or entry['fingerprint'] == fingerprint):
+            return
+
+        start = EventFeed.parse_datetime(event['start']['dateTime'])
+        end = EventFeed.parse_datetime(event['end']['dateTime']) if 'dateTime' in event.get('end', {}) \
+            else start + datetime.timedelta(hours=3)
+        self.put(post_id, fingerprint, event, start, end)
+
+    def put(self, post_id, fingerprint, event_json, start, end):
+        event = {
+            'id': post_id,
+            'summary': event_json.get('summary', ''),
+            'location': event_json.get('location', ''),
+            'description': event_json.get('description', ''),
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+        }
+        self.entries[post_id] = {
+            'fingerprint': fingerprint,
+            'end': end.timestamp(),
+            'event': event,
+            'vevent': self.render_vevent(post_id, event, start, end),
+        }
+        self.dirty = True
+
+    def remove(self, post_id):
+        if self.entries.pop(str(post_id), None) is not None:
+            self.dirty = True
+
+    # Drop events that finished more than keep_days ago - and the oldest events if we're over max_events.
+    def expire(self, now):
+        cutoff = (now - datetime.timedelta(days=self.keep_days)).timestamp()
+        for post_id in [post_id for post_id, entry in self.entries.items() if entry['end'] < cutoff]:
+            self.remove(post_id)
+
+        if len(self.entries) > self.max_events:
+            by_end = sorted(self.entries, key=lambda post_id: self.entries[post_id]['end'])
+            for post_id in by_end[:len(self.entries) - self.max_events]:
+                self.remove(post_id)
+
+    # Write the feed (if anything changed).
+    def save(self):
+        self.expire(datetime.datetime.now(timezone.utc))
+        if not self.dirty:
+            return
+
+        entries = sorted(self.entries.values(), key=lambda entry: entry['event']['start'])
+        lines = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//' + self.calendar_name + '//calendarbot//EN',
+            'CALSCALE:GREGORIAN',
+            EventFeed.fold('X-WR-CALNAME:' + EventFeed.escape(self.calendar_name)),
+        ]
+        lines.extend(entry['vevent'] for entry in entries)
+        lines.append('END:VCALENDAR')
+        EventFeed.write_atomic(self.ics_filename, '\r\n'.join(lines) + '\r\n', newline='')
+
+        if self.json_filename:
+            EventFeed.write_atomic(self.json_filename, json.dumps([entry['event'] for entry in entries], indent=1))
+
+        EventFeed.write_atomic(self.state_filename, json.dumps(self.entries))
+        self.dirty = False
+        logging.info('Event feed written: ' + str(len(entries)) + ' events to ' + self.ics_filename)
+
+    def render_vevent(self, post_id, event, start, end):
+        lines = [
+            'BEGIN:VEVENT',
+            'UID:' + post_id + '@' + self.calendar_name.replace(' ', ''),
+            'DTSTAMP:' + datetime.datetime.now(timezone.utc).strftime(EventFeed.ICS_DATE_TIME_FORMAT),
+            'DTSTART:' + start.strftime(EventFeed.ICS_DATE_TIME_FORMAT),
+            'DTEND:' + end.strftime(EventFeed.ICS_DATE_TIME_FORMAT),
+            'SUMMARY:' + EventFeed.escape(event['summary']),
+            'LOCATION:' + EventFeed.escape(event['location']),
+            'DESCRIPTION:' + EventFeed.escape(event['description']),
+            'END:VEVENT',
+        ]
+        return '\r\n'.join(EventFeed.fold(line) for line in lines)
+
+    # Google date/time (RFC 3339) -> UTC datetime.
+    @staticmethod
+    def parse_datetime(text):
+        parsed = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.astimezone(timezone.utc)
+
+    # ics text escaping (RFC 5545 3.3.11)
+    @staticmethod
+    def escape(text):
+        return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n') \
+            .replace('\n', '\\n')
+
+    # ics lines are folded at 75 octets (RFC 5545 3.1) - continuation lines start with a space.
+    @staticmethod
+    def fold(line):
+        encoded = line.encode('utf-8')
+        if len(encoded) <= 75:
+            return line
+
+        folded = []
+        limit = 75
+        while encoded:
+            cut = min(limit, len(encoded))
+            # don't split a multi-byte character
+            while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+                cut -= 1
+            folded.append(encoded[:cut].decode('utf-8'))
+            encoded = encoded[cut:]
+            limit = 74
+        return '\r\n '.join(folded)
+
+    @staticmethod
+    def write_atomic(filename, text, newline=None):
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w', encoding='utf-8', newline=newline) as temp_file:
+            temp_file.write(text)
+        os.replace(temp_filename, filename)
+
+
+# Outbox - calendar and comment writes that failed, persisted so they're retried exactly (with backoff) rather than
+# rediscovered by chance on a later scan.  Entries are keyed per post and kind of write (the idempotency key), so a
+# newer write for the same post replaces an older one.  Operations:
+#   event.write   - payload: body, event_id (optional), comment (optional notification to post once written)
+#   event.delete  - delete the post's event(s)
+#   comment.post  - payload: text (edits the bot's existing comment, if there is one)
+class Outbox:
+    # Which client each operation uses.
+    LANES = {'event.write': GOOGLE, 'event.delete': GOOGLE, 'comment.post': REDDIT}
+
+    def __init__(self, filename=None, max_attempts=10, backoff_seconds=60, max_backoff_seconds=60 * 60,
+                 max_per_cycle=20, max_entries=500):
+        self.filename = filename
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_per_cycle = max_per_cycle
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, filename, outbox_filename):
+        config = configparser.ConfigParser()
+        config.read(filename)
+        return cls(
+            outbox_filename,
+            config.getint(OUTBOX, 'max_attempts', fallback=10),
+            config.getint(OUTBOX, 'backoff_seconds', fallback=60),
+            config.getint(OUTBOX, 'max_backoff_seconds', fallback=60 * 60),
+            config.getint(OUTBOX, 'max_per_cycle', fallback=20),
+            config.getint(OUTBOX, 'max_entries', fallback=500)
+        )
+
+    # idempotency key
+    @staticmethod
+    def key(op, post_id):
+        return op.split('.')[0] + ':' + str(post_id)
+
+    # Queue an operation, replacing any pending operation with the same key.
+    def add(self, op, post_id, payload=None):
+        import uuid
+
+        key = Outbox.key(op, post_id)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = {'id': uuid.uuid4().hex, 'key': key, 'op': op, 'post_id': str(post_id),
+                                 'payload': payload or {}, 'attempts': 0, 'next_attempt': time.time(),
+                                 'last_error': None}
+            while len(self.entries) > self.max_entries:
+                dropped_key, dropped = self.entries.popitem(last=False)
+                logging.error('Outbox full - dropping: ' + dropped['op'] + ' for post ' + dropped['post_id'])
+        logging.info('Outbox: queued ' + op + ' for post ' + str(post_id))
+
+    # A write went through some other way - nothing left to retry.
+    def discard(self, op, post_id):
+        with self.lock:
+            self.entries.pop(Outbox.key(op, post_id), None)
+
+    # Entries due for another attempt, by lane (client), oldest first - at most max_per_cycle per lane.
+    def due(self, now):
+        lanes = {}
+        with self.lock:
+            for entry in self.entries.values():
+                if entry['next_attempt'] <= now:
+                    lane = lanes.setdefault(Outbox.LANES[entry['op']], [])
+                    if len(lane) < self.max_per_cycle:
+                        lane.append(dict(entry))
+        return lanes
+
+    def succeeded(self, entry):
+        with self.lock:
+            # unless it's been replaced by a newer write in the meantime.
+            if self.entries.get(entry['key'], {}).get('id') == entry['id']:
+                del self.entries[entry['key']]
+
+    def failed(self, entry, error):
+        with self.lock:
+            current = self.entries.get(entry['key'])
+            if current is None or current['id'] != entry['id']:
+                return
+            current['attempts'] += 1
+            current['last_error'] = str(error)
+            if current['attempts'] >= self.max_attempts:
+                logging.error('Outbox: giving up on ' + current['op'] + ' for post ' + current['post_id'] + ' after ' +
+                              str(current['attempts']) + ' attempts. Error: ' + str(error))
+                del self.entries[entry['key']]
+                return
+            delay = min(self.backoff_seconds * 2 ** (current['attempts'] - 1), self.max_backoff_seconds)
+            current['next_attempt'] = time.time() + delay
+            logging.warning('Outbox: ' + current['op'] + ' for post ' + current['post_id'] + ' failed (attempt ' +
+                            str(current['attempts']) + ') - retrying in ' + str(delay) + ' seconds. Error: ' +
+                            str(error))
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as outbox_file:
+                for entry in json.load(outbox_file):
+                    self.entries[entry['key']] = entry
+            logging.info('Loaded ' + str(len(self.entries)) + ' pending outbox entries from: ' + self.filename)
+        except Exception as e:
+            logging.error('Unable to load outbox: ' + self.filename + '. Error: ' + str(e))
+
+    # Save to disk - write to a temporary file and swap, so a crash can't lose the lot.
+    def save(self):
+        if not self.filename:
+            return
+        with self.lock:
+            entries = list(self.entries.values())
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as outbox_file:
+            json.dump(entries, outbox_file)
+        os.replace(temp_filename, self.filename)
 
 
 # Google client - use to manipulate Google's calendar.
@@ -466,16 +1460,28 @@ Calendar bot post.  Any problems, please let /u/kajh know!  Bot [docs here]({cal
     TEMPLATE_PARSE_PROBLEM = "I couldn't work out the title of your post as it didn't match the recommended format."
     TEMPLATE_PARSE_SOLUTION = "Please refer to [this sticky post](https://reddit.com/r/{subreddit}/{template_post_link}) for an example run post. " \
                               "The title needs to follow the specified format so that I can understand it.  " \
-                              "Given we can't modify post titles, you can edit your post and put a calendar hint anywhere into the text of your job - cut/paste/modify the following: *{CALENDAR_HINT: [Metaplot, if any] Name of Run. 2021-08-16. 2300 UTC}*."
+                              "Given we can't modify post titles, you can edit your post and put a calendar hint anywhere into the text of your job - cut/paste/modify the following: *{{CALENDAR_HINT: [Metaplot, if any] Name of Run. 2021-08-16. 2300 UTC}}*."
 
     TEMPLATE_GOOGLE_PROBLEM = "I got an error from Google Calendar when creating your event."
     TEMPLATE_GOOGLE_SOLUTION = "I'm not sure how to fix.  The error message I got from Google was: {message}"
 
-    def __init__(self):
+    def __init__(self, feed=None, outbox=None, listing_state=None, cleanup_schedule=None):
         self.redditClient = None
         self.redditService = None
         self.googleClient = None
         self.googleService = None
+        self.feed = feed
+        self.outbox = outbox
+        self.listing_state = listing_state
+        self.cleanup_schedule = cleanup_schedule
+
+    # Drop the authenticated clients (and everything they hold on to).
+    def release(self):
+        if self.redditClient is not None:
+            self.redditClient.release()
+        if self.googleClient is not None:
+            self.googleClient.release()
+        self.redditClient = self.redditService = self.googleClient = self.googleService = None
 
     #
     # Iterate over all submissions, creating (or updating) google calendar events.
@@ -485,124 +1491,266 @@ Calendar bot post.  Any problems, please let /u/kajh know!  Bot [docs here]({cal
         try:
             logging.info('Reading jobs on ' + self.redditClient.subreddit_name + '.')
 
-            # read submissions
-            submissions = self.redditClient.get_submissions(self.redditService)
-            for submission in submissions:
+            # read submissions.  Hand each one over (and drop it) as we go, so a processed submission - and the comment
+            # forest it's loaded - can be freed straight away rather than living to the end of the cycle.
+            submissions = collections.deque(self.redditClient.get_submissions(self.redditService, self.listing_state))
+            while submissions:
+                submission = submissions.popleft()
+                try:
+                    with log_duration('submission', post_id=submission.id):
+                        self.process_submission(submission)
+                except Exception as e:
+                    logging.exception('error processing submission: ' + submission.id)
 
-                # Skip if post is flaired 'Meta'.
-                if (submission.link_flair_text is not None and 'META' in submission.link_flair_text.upper()):
-                    logging.info('skipping meta-flaired post: ' + submission.title)
+                # move on either way - a post that keeps failing mustn't hold up the posts after it.
+                if self.listing_state is not None:
+                    self.listing_state.saw(submission)
 
-                    # Skip post
-                    continue
+            if self.listing_state is not None:
+                self.listing_state.commit()
+                self.listing_state.save()
 
-                # Otherwise - process submission
-                job = None
-                try:
-                    logging.info('processing submission: ' + submission.title)
-                    job = self.redditClient.to_job(submission)
-                    logging.debug('parsed_job = ' + str(vars(job)))
+        except Exception as e:
+            logging.exception('error reading ' + self.redditClient.subreddit_name + ' jobs')
+            return
 
-                except Exception as e:
-                    logging.error('unable to parse submission: ' + submission.title + '. Error: ' + str(e))
-
-                    # Post parse error to the thread.
-                    self.redditClient.post_comment(submission,
-                                                   CalendarBot.TEMPLATE_ERROR.format(
-                                                       author='/u/' + submission.author.name,
-                                                       calendar_public_url=self.googleClient.calendar_public_url,
-                                                       problem=CalendarBot.TEMPLATE_PARSE_PROBLEM,
-                                                       subreddit_name=self.redditClient.subreddit_name,
-                                                       solution=CalendarBot.TEMPLATE_PARSE_SOLUTION.format(
-                                                           subreddit=self.redditClient.subreddit,
-                                                           template_post_link=self.redditClient.template_post_link
-                                                       ),
-                                                       calendar_docs_url=self.googleClient.calendar_docs_url)
-                                                   )
-
-                    # next submission
-                    continue
+    #
+    # Process a single post: parse it, create (or update) its google calendar event, and comment back.
+    #
+    def process_submission(self, submission):
+        # Skip if post is flaired 'Meta'.
+        if (submission.link_flair_text is not None and 'META' in submission.link_flair_text.upper()):
+            logging.info('skipping meta-flaired post: ' + submission.title)
 
-                # Find and update/create event
-                try:
-                    logging.info('Finding event for submission: ' + submission.title)
-                    event = self.googleClient.find_event(job.post_id)
-                    if event:
-                        logging.info('Event found for submission: ' + submission.title + '. Updating.')
-                        self.googleClient.update_event(event, job)
-                    else:
-                        logging.info('No event found for submission: ' + submission.title + '. Creating.')
-                        self.googleClient.create_event(job)
+            # Skip post
+            return
 
-                except Exception as e:
-                    logging.error(
-                        'received error from google calendar apis: ' + submission.title + '. Error: ' + str(e))
-
-                    # Post parse error to the thread.
-                    self.redditClient.post_comment(submission,
-                                                   CalendarBot.TEMPLATE_ERROR.format(
-                                                       author='/u/' + submission.author.name,
-                                                       calendar_public_url=self.googleClient.calendar_public_url,
-                                                       problem=CalendarBot.TEMPLATE_GOOGLE_PROBLEM,
-                                                       solution=CalendarBot.TEMPLATE_GOOGLE_SOLUTION.format(
-                                                           message=str(e)),
-                                                       calendar_docs_url=self.googleClient.calendar_docs_url)
-                                                   )
-
-                    # next submission
-                    continue
+        # Otherwise - process submission
+        job = None
+        try:
+            logging.info('processing submission: ' + submission.title)
+            job = self.redditClient.to_job(submission)
 
-                # Success! Post comment to Job thread with link to calendar.
-                try:
-                    job_start = job.get_start_datetime()
-                    run_time = int(job_start.timestamp())
-
-                    # Update or create the calendar notification post.
-                    self.redditClient.post_comment(
-                        submission, CalendarBot.TEMPLATE_NOTIFICATION
-                        .format(subreddit_name=self.googleClient.subreddit_name,
-                                calendar_public_url=self.googleClient.calendar_public_url,
-                                calendar_docs_url=self.googleClient.calendar_docs_url,
-                                run_time=run_time)
-                    )
+        except Exception as e:
+            logging.error('unable to parse submission: ' + submission.title + '. Error: ' + str(e))
+
+            # Post parse error to the thread.
+            self.post_comment(submission,
+                              CalendarBot.TEMPLATE_ERROR.format(
+                                  author=RedditClient.author_name(submission),
+                                  calendar_public_url=self.googleClient.calendar_public_url,
+                                  problem=CalendarBot.TEMPLATE_PARSE_PROBLEM,
+                                  subreddit_name=self.redditClient.subreddit_name,
+                                  solution=CalendarBot.TEMPLATE_PARSE_SOLUTION.format(
+                                      subreddit=self.redditClient.subreddit,
+                                      template_post_link=self.redditClient.template_post_link
+                                  ),
+                                  calendar_docs_url=self.googleClient.calendar_docs_url)
+                              )
+
+            # done
+            return
 
-                except Exception as e:
-                    logging.exception('error commenting back to reddit', e)
+        # Find and update/create event
+        event = notification = None
+        try:
+            # Notification comment - link to the calendar.
+            notification = CalendarBot.TEMPLATE_NOTIFICATION.format(
+                subreddit_name=self.googleClient.subreddit_name,
+                calendar_public_url=self.googleClient.calendar_public_url,
+                calendar_docs_url=self.googleClient.calendar_docs_url,
+                run_time=int(job.get_start_datetime().timestamp()))
+
+            logging.info('Finding event for submission: ' + submission.title)
+            event = self.googleClient.find_event(job.post_id)
+            if event:
+                logging.info('Event found for submission: ' + submission.title + '. Updating.')
+                self.googleClient.update_event(event, job)
+            else:
+                logging.info('No event found for submission: ' + submission.title + '. Creating.')
+                self.googleClient.create_event(job)
 
-                # next submission
-                continue
+            # Written - drop any pending retry.
+            if self.outbox is not None:
+                self.outbox.discard('event.write', job.post_id)
+
+        except Exception as e:
+            logging.error(
+                'received error from google calendar apis: ' + submission.title + '. Error: ' + str(e))
+
+            # Retry the write (and the notification after it) from the outbox - unless the job itself is broken.
+            if self.outbox is not None and notification is not None:
+                self.outbox.add('event.write', job.post_id, {'body': self.googleClient.build_event_json(job),
+                                                            'event_id': event['id'] if event else None,
+                                                            'comment': notification})
+
+            # Post parse error to the thread.
+            self.post_comment(submission,
+                              CalendarBot.TEMPLATE_ERROR.format(
+                                  author=RedditClient.author_name(submission),
+                                  calendar_public_url=self.googleClient.calendar_public_url,
+                                  problem=CalendarBot.TEMPLATE_GOOGLE_PROBLEM,
+                                  subreddit_name=self.redditClient.subreddit_name,
+                                  solution=CalendarBot.TEMPLATE_GOOGLE_SOLUTION.format(
+                                      message=str(e)),
+                                  calendar_docs_url=self.googleClient.calendar_docs_url)
+                              )
+
+            # done
+            return
+
+        # Mirror to the local feed.
+        if self.feed is not None:
+            try:
+                self.feed.update(job, self.googleClient.build_event_json(job))
+            except Exception as e:
+                logging.exception('unable to update event feed')
+
+        # Success! Post comment to Job thread with link to calendar.
+        try:
+            # Update or create the calendar notification post.
+            self.post_comment(submission, notification)
 
         except Exception as e:
-            logging.exception('error reading ' + self.redditClient.subreddit_name + ' jobs', e)
+            logging.exception('error commenting back to reddit')
+
+    # Post (or edit) the bot's comment - if that fails, queue it in the outbox.
+    def post_comment(self, submission, text):
+        if self.redditClient.post_comment(submission, text):
+            if self.outbox is not None:
+                self.outbox.discard('comment.post', submission.id)
+        elif self.outbox is not None:
+            self.outbox.add('comment.post', submission.id, {'text': text})
+
+    #
+    # Retry failed writes from the outbox.  Each client gets its own worker (lane) - the reddit and google clients
+    # aren't thread-safe, but can run alongside each other - and each lane is capped per cycle.
+    #
+    def drain_outbox(self):
+        import concurrent.futures
+
+        lanes = self.outbox.due(time.time())
+        if not lanes:
             return
 
+        logging.info('Draining outbox: ' + ', '.join(lane + ' ' + str(len(entries)) for lane, entries in lanes.items()))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(lanes)) as executor:
+            for future in [executor.submit(self.drain_outbox_lane, entries) for entries in lanes.values()]:
+                future.result()
+        self.outbox.save()
+
+    def drain_outbox_lane(self, entries):
+        for entry in entries:
+            try:
+                self.apply_outbox_entry(entry)
+                self.outbox.succeeded(entry)
+            except Exception as e:
+                self.outbox.failed(entry, e)
+
+    def apply_outbox_entry(self, entry):
+        op, post_id, payload = entry['op'], entry['post_id'], entry['payload']
+        logging.info('Outbox: retrying ' + op + ' for post ' + post_id)
+
+        if op == 'event.write':
+            self.googleClient.write_event(post_id, payload['body'], payload.get('event_id'))
+            if payload.get('comment'):
+                # the notification goes out through the reddit lane.
+                self.outbox.add('comment.post', post_id, {'text': payload['comment']})
+
+        elif op == 'event.delete':
+            self.googleClient.delete_event(post_id)
+
+        elif op == 'comment.post':
+            submission = self.redditService.submission(id=post_id)
+            if not self.redditClient.post_comment(submission, payload['text']):
+                raise Exception('Unable to comment on post: ' + post_id)
+
+        else:
+            raise Exception('Unknown outbox operation: ' + op)
+
+    #
+    # Process a single post, by id - for on-demand syncs between cycles.
+    #
+    def process_post(self, post_id):
+        submission = self.redditService.submission(id=post_id)
+        if submission.subreddit.display_name.lower() != self.redditClient.subreddit.lower():
+            logging.warning('Not syncing post ' + post_id + ' - it is on /r/' + submission.subreddit.display_name +
+                            ', not /r/' + self.redditClient.subreddit + '.')
+            return
+        self.process_submission(submission)
+
+        # Publish the local feed.
+        if self.feed is not None:
+            self.feed.save()
+        if self.outbox is not None:
+            self.outbox.save()
+
     #
     # Iterate over all submissions, deleting google calendar events if the equivalent reddit post has been deleted or
-    # flaired META.
+    # flaired META.  With a cleanup schedule, only this cycle's slice of events is checked.
     #
     def cleanup_orphan_events(self):
         current_time = datetime.datetime.now(timezone.utc)
         logging.info('Event cleanup from: ' + current_time.strftime(GoogleClient.DATE_TIME_FORMAT))
-        events = self.googleClient.find_future_events(current_time)
+        if self.cleanup_schedule is not None:
+            # Bring our index of the calendar up to date, and check this cycle's slice of it.
+            changed = self.cleanup_schedule.refresh(self.googleClient)
+            events = self.cleanup_schedule.select(current_time.timestamp())
+            logging.info('Checking ' + str(len(events)) + ' of ' + str(len(self.cleanup_schedule.events)) +
+                         ' future events this cycle.')
+        else:
+            changed = events = self.googleClient.find_future_events(current_time)
+
+        # Seed the local feed with what's in the calendar.
+        if changed and self.feed is not None:
+            try:
+                for event in changed:
+                    self.feed.update_from_event(event)
+            except Exception as e:
+                logging.exception('unable to seed event feed')
 
         # iterate over events - if the reddit post has been deleted, delete the calendar event.
-        if events is not None:
+        if events:
+            # lookup reddit posts - up to 100 a request.
+            post_ids = [event['extendedProperties']['private']['redditPost'] for event in events]
+            submissions = {submission.id: submission for submission in
+                           self.redditService.info(fullnames=['t3_' + post_id for post_id in post_ids])}
+
             for event in events:
                 reddit_post_id = event['extendedProperties']['private']['redditPost']
                 logging.info("Event:" + event['summary'] + ", reddit post id = " + reddit_post_id)
 
-                # lookup reddit post
-                submission = self.redditService.submission(id=reddit_post_id)
+                submission = submissions.get(reddit_post_id)
+                if submission is None:
+                    logging.warning("Reddit post not found: " + reddit_post_id + " - no action taken.")
+                    continue
+
+                if self.cleanup_schedule is not None:
+                    self.cleanup_schedule.mark_verified(reddit_post_id, current_time.timestamp())
+
                 if submission.removed_by_category is not None:
                     logging.info("Message removed: " + submission.removed_by_category + ".  Calendar event deleted.")
 
                     # delete calendar event
-                    self.googleClient.delete_event(reddit_post_id)
+                    try:
+                        self.googleClient.delete_event(reddit_post_id)
+                    except Exception as e:
+                        if self.outbox is None:
+                            raise
+                        logging.error('unable to delete event for post: ' + reddit_post_id + '. Error: ' + str(e))
+                        self.outbox.add('event.delete', reddit_post_id)
+                    if self.feed is not None:
+                        self.feed.remove(reddit_post_id)
+                    if self.cleanup_schedule is not None:
+                        self.cleanup_schedule.forget(reddit_post_id)
                 else:
                     logging.info("Message not removed - no action taken.")
         else:
             logging.info("No future events retrieved.")
 
+        if self.cleanup_schedule is not None:
+            self.cleanup_schedule.save()
+
         # Done
         return
 
@@ -613,7 +1761,7 @@ Calendar bot post.  Any problems, please let /u/kajh know!  Bot [docs here]({cal
             self.redditClient = RedditClient.from_file(config_directory + '/calendarbot.cfg')
             self.redditService = self.redditClient.authenticate()
         except Exception as e:
-            logging.exception('unable to authenticate against Reddit', e)
+            logging.exception('unable to authenticate against Reddit')
             return
 
         # Authenticate against Google
@@ -623,39 +1771,693 @@ Calendar bot post.  Any problems, please let /u/kajh know!  Bot [docs here]({cal
             credentials = self.googleClient.credentials(config_directory, '/credentials.json')
             self.googleService = self.googleClient.authenticate(credentials)
         except Exception as e:
-            logging.exception('unable to authenticate against Google', e)
+            logging.exception('unable to authenticate against Google')
             return
 
+        # Retry failed writes first.
+        if self.outbox is not None:
+            try:
+                with log_duration('cycle.phase', phase='outbox'):
+                    self.drain_outbox()
+            except Exception as e:
+                logging.exception('error draining outbox')
+
         # Process all reddit submissions
-        self.process_reddit_submissions()
+        with log_duration('cycle.phase', phase='submissions'):
+            self.process_reddit_submissions()
 
         # Cleanup calendar - remove events if the reddit post has been deleted.
-        self.cleanup_orphan_events()
+        with log_duration('cycle.phase', phase='cleanup'):
+            self.cleanup_orphan_events()
 
+        # Publish the local feed.
+        if self.feed is not None:
+            try:
+                with log_duration('cycle.phase', phase='feed'):
+                    self.feed.save()
+            except Exception as e:
+                logging.exception('unable to write event feed')
+
+        # Persist anything newly queued.
+        if self.outbox is not None:
+            self.outbox.save()
+
+
+# Run lock - makes sure only one bot runs against a configuration directory at a time.  Overlapping scheduler runs
+# otherwise race each other on find_event/create_event and create duplicate events.  The lock file holds the owner's pid
+# and a heartbeat - if the heartbeat goes stale (owner died or hung), the next run takes the lock over.  The owner
+# heartbeats from a background thread, so a long cycle still counts as alive.  Anything that reads then rewrites the
+# lock file does so holding a guard file, so a heartbeat can't overwrite a takeover.  A daemon owner can be woken
+# (SIGUSR1) to run a cycle immediately.
+class RunLock:
+    # Heartbeat at least this often while we hold the lock.
+    HEARTBEAT_SECONDS = 60
+
+    # A guard file older than this was left behind by a crashed run.
+    GUARD_STALE_SECONDS = 30
+
+    # Wake-up signal (not on Windows).
+    WAKE_SIGNAL = getattr(signal, 'SIGUSR1', None)
+
+    def __init__(self, filename, daemon=False, stale_seconds=15 * 60):
+        self.filename = filename
+        self.daemon = daemon
+        self.stale_seconds = stale_seconds
+        self.held = False
+        self.wake_requested = False
+        self.owner = None
+        self.guard_filename = filename + '.guard'
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    # Try to take the lock.  Returns False if another live bot holds it (details in self.owner).
+    def acquire(self):
+        for attempt in range(2):
+            try:
+                with self.guarded():
+                    fd = os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    os.close(fd)
+                self.held = True
+                self.heartbeat()
+                self.start_heartbeat()
+                if RunLock.WAKE_SIGNAL is not None:
+                    signal.signal(RunLock.WAKE_SIGNAL, self.on_wake)
+                return True
+            except FileExistsError:
+                pass
+
+            # Someone else has it - is it stale?
+            self.owner = self.read()
+            if not self.is_stale(self.owner):
+                return False
+            if not self.take_over(self.owner):
+                return False
+
+        return False
 
-# Bot main loop
-if __name__ == '__main__':
-    # Which configuration direction do we use?
-    config_directory = None
-    if (len(sys.argv) == 2):
-        # grab the configuration directory
-        config_directory = sys.argv[1]
-        logging.info('Configuration directory = ' + config_directory)
-
-        # Loop while running.
+    def release(self):
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        if self.held:
+            with self.guarded():
+                owner = self.read()
+                if owner is not None and owner.get('pid') == os.getpid():
+                    os.remove(self.filename)
+            self.held = False
+
+    # Hold the guard file for a read-then-write of the lock file.  Only ever held for a moment.
+    @contextlib.contextmanager
+    def guarded(self):
         while True:
             try:
-                CalendarBot().run(config_directory)
+                os.close(os.open(self.guard_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.guard_filename) > RunLock.GUARD_STALE_SECONDS:
+                        logging.warning('Removing stale run lock guard: ' + self.guard_filename)
+                        os.remove(self.guard_filename)
+                        continue
+                except OSError:
+                    # gone already
+                    continue
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.remove(self.guard_filename)
+
+    # Refresh the heartbeat.  Returns False if we've lost the lock (another run judged us stale and took over).
+    def heartbeat(self):
+        if not self.held:
+            return False
+        with self.guarded():
+            owner = self.read()
+            if owner is not None and owner.get('pid') != os.getpid():
+                logging.error('Run lock taken over by pid ' + str(owner.get('pid')) + '.')
+                self.held = False
+                return False
+
+            temp_filename = self.filename + '.' + str(os.getpid())
+            with open(temp_filename, 'w') as lock_file:
+                json.dump({'pid': os.getpid(), 'daemon': self.daemon, 'heartbeat': time.time()}, lock_file)
+            os.replace(temp_filename, self.filename)
+        return True
+
+    # Heartbeat in the background until released (or the lock is lost).
+    def start_heartbeat(self):
+        self.stopped.clear()
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, name='run-lock-heartbeat', daemon=True)
+        self.heartbeat_thread.start()
+
+    def heartbeat_loop(self):
+        while not self.stopped.wait(RunLock.HEARTBEAT_SECONDS):
+            try:
+                if not self.heartbeat():
+                    return
             except Exception as e:
-                logging.exception('bot error', e)
+                logging.error('Unable to refresh run lock heartbeat. Error: ' + str(e))
+
+    # Wait between cycles.  Returns early if woken.  Returns False if we've lost the lock.
+    def wait(self, seconds):
+        deadline = time.monotonic() + seconds
+        while self.held and not self.wake_requested and time.monotonic() < deadline:
+            time.sleep(min(1, max(0, deadline - time.monotonic())))
+
+        if self.wake_requested:
+            logging.info('Woken up - running a cycle now.')
+        self.wake_requested = False
+        return self.heartbeat()
+
+    def on_wake(self, signum, frame):
+        self.wake_requested = True
+
+    # Ask the lock owner (if it's a daemon) to run a cycle now.  Returns True if signalled.
+    def wake_owner(self):
+        if RunLock.WAKE_SIGNAL is None or not self.owner or not self.owner.get('daemon'):
+            return False
+        try:
+            os.kill(self.owner['pid'], RunLock.WAKE_SIGNAL)
+            return True
+        except OSError:
+            return False
 
-            # go back to sleep for a few minutes
-            seconds = (5 * 60)
-            logging.info("Sleeping for " + str(seconds) + " seconds.")
-            time.sleep(seconds)
+    def read(self):
+        try:
+            with open(self.filename, 'r') as lock_file:
+                return json.load(lock_file)
+        except (OSError, ValueError):
+            # missing, or mid-creation
+            return None
+
+    def is_stale(self, owner):
+        # unreadable - either just created and not written yet, or junk.  Go on the file's age.
+        if owner is None:
+            try:
+                return time.time() - os.path.getmtime(self.filename) > self.stale_seconds
+            except OSError:
+                return True
+
+        if time.time() - owner.get('heartbeat', 0) > self.stale_seconds:
+            return True
+
+        # owner process gone?
+        if RunLock.WAKE_SIGNAL is not None:
+            try:
+                os.kill(owner['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except OSError:
+                pass
+        return False
+
+    # Move a stale lock aside.  Check we moved the lock we judged stale - not one another run has just taken, or one
+    # whose owner has heartbeated since.
+    def take_over(self, stale_owner):
+        stale_filename = self.filename + '.stale.' + str(os.getpid())
+        with self.guarded():
+            try:
+                os.rename(self.filename, stale_filename)
+            except FileNotFoundError:
+                return True
+            except OSError:
+                return False
+
+            with open(stale_filename, 'r') as stale_file:
+                try:
+                    moved_owner = json.load(stale_file)
+                except ValueError:
+                    moved_owner = None
+
+            if moved_owner != stale_owner:
+                # not the lock we judged stale - put it back.
+                os.replace(stale_filename, self.filename)
+                return False
+
+            logging.warning('Taking over stale run lock: ' + str(stale_owner))
+            os.remove(stale_filename)
+        return True
+
+
+# Sync server - a small local HTTP endpoint on the running bot that syncs a single post right away, rather than waiting
+# for the next cycle (eg. after a GM adds a calendar hint).  POST /sync/<post id>.  Requests are queued to one worker
+# thread, so repeat requests for a post that's still waiting are coalesced.  Syncs use the current cycle's
+# authenticated bot, and never run at the same time as a cycle.  Only POSTs are accepted (so a web page can't trigger
+# a sync with an image link), with a shared token (Authorization: Bearer <token>) if one is configured - and one must
+# be, to listen on anything but loopback.
+class SyncServer:
+    # reddit post ids are base36, optionally with the t3_ (link) prefix.
+    POST_ID_PATTERN = re.compile('(?:t3_)?([a-z0-9]{1,12})')
+
+    # Most posts we'll queue - past this, requests are turned away.
+    MAX_PENDING = 100
+
+    def __init__(self, address='127.0.0.1', port=8765, token=None):
+        self.address = address
+        self.port = port
+        self.token = token
+        self.bot = None
+        self.bot_lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.condition = threading.Condition()
+        self.server = None
+
+    # Returns None if no sync server is configured.
+    @classmethod
+    def from_file(cls, filename):
+        config = configparser.ConfigParser()
+        config.read(filename)
+        if not config.has_option(SYNC, 'port'):
+            return None
+
+        address = config.get(SYNC, 'address', fallback='127.0.0.1')
+        token = config.get(SYNC, 'token', fallback=None)
+        if token is None and not SyncServer.is_loopback(address):
+            logging.error('Sync server not started - a [Sync] token is required to listen on ' + address + '.')
+            return None
+        return cls(address, config.getint(SYNC, 'port'), token)
+
+    @staticmethod
+    def is_loopback(address):
+        import ipaddress
+
+        if address == 'localhost':
+            return True
+        try:
+            return ipaddress.ip_address(address).is_loopback
+        except ValueError:
+            return False
+
+    def start(self):
+        import http.server
+
+        sync_server = self
+
+        class SyncRequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond(405, {'error': 'use POST'}, {'Allow': 'POST'})
+
+            def do_POST(self):
+                if sync_server.token is not None and not hmac.compare_digest(
+                        self.headers.get('Authorization', ''), 'Bearer ' + sync_server.token):
+                    self.respond(401, {'error': 'bad or missing token'})
+                    return
+
+                parts = self.path.strip('/').split('/')
+                m = SyncServer.POST_ID_PATTERN.fullmatch(parts[-1]) if len(parts) == 2 and parts[0] == 'sync' \
+                    else None
+                if not m:
+                    self.respond(404, {'error': 'expected /sync/<post id>'})
+                    return
+                queued = sync_server.request(m.group(1))
+                if queued is None:
+                    self.respond(429, {'error': 'too many pending syncs'})
+                    return
+                self.respond(202, {'post_id': m.group(1), 'queued': queued})
+
+            def respond(self, status, body, headers=None):
+                text = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_request(self, code='-', size='-'):
+                log_event(logging.DEBUG, 'sync.request', client=self.client_address[0], request=self.requestline,
+                          status=code)
+
+            def log_message(self, format, *args):
+                log_event(logging.DEBUG, 'sync.message', client=self.client_address[0], format=format, args=args)
+
+        self.server = http.server.HTTPServer((self.address, self.port), SyncRequestHandler)
+        threading.Thread(target=self.server.serve_forever, name='sync-server', daemon=True).start()
+        threading.Thread(target=self.work, name='sync-worker', daemon=True).start()
+        logging.info('Sync server listening on ' + self.address + ':' + str(self.server.server_address[1]))
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # Queue a post for syncing.  Returns False if it was already waiting (coalesced), None if the queue is full.
+    def request(self, post_id):
+        with self.condition:
+            if post_id in self.pending:
+                return False
+            if len(self.pending) >= SyncServer.MAX_PENDING:
+                return None
+            self.pending[post_id] = True
+            self.condition.notify()
+            return True
+
+    # Worker thread - sync queued posts one at a time.
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+
+            # Leave the post queued (so repeat requests coalesce) until we can actually sync it.
+            with self.bot_lock:
+                with self.condition:
+                    post_id, ignored = self.pending.popitem(last=False)
+                if self.bot is None or self.bot.redditService is None or self.bot.googleService is None:
+                    logging.warning('Sync requested for post ' + post_id + ' before the bot has authenticated - '
+                                    'it will be picked up by the next cycle.')
+                    continue
+                try:
+                    logging.info('On-demand sync of post: ' + post_id)
+                    self.bot.process_post(post_id)
+                except Exception as e:
+                    logging.exception('on-demand sync failed for post: ' + post_id)
+
+
+# Memory monitor - for long-running bots on small hosts.  Records RSS (and optionally tracemalloc's biggest growth) each
+# cycle, and reports when the bot is over its memory budget so main() can soft restart it.
+class MemoryMonitor:
+    def __init__(self, budget_mb=None, trace=False, top=10):
+        self.budget_mb = budget_mb
+        self.trace = trace
+        self.top = top
+        self.snapshot = None
+
+    @classmethod
+    def from_file(cls, filename):
+        config = configparser.ConfigParser()
+        config.read(filename)
+        return cls(
+            config.getint(MEMORY, 'budget_mb', fallback=None),
+            config.getboolean(MEMORY, 'tracemalloc', fallback=False),
+            config.getint(MEMORY, 'tracemalloc_top', fallback=10)
+        )
+
+    def start(self):
+        if self.trace:
+            import tracemalloc
+
+            tracemalloc.start()
 
-    else:
+    # Current resident set size in MB, or None if we can't tell (not Linux).
+    @staticmethod
+    def rss_mb():
+        try:
+            with open('/proc/self/status', 'r') as status_file:
+                for line in status_file:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    # Record memory use for the cycle.  Returns True if we're over budget.
+    def sample(self):
+        rss = MemoryMonitor.rss_mb()
+        logging.info('Memory: RSS ' + ('%.1f MB' % rss if rss is not None else 'unknown') +
+                     (' (budget ' + str(self.budget_mb) + ' MB)' if self.budget_mb else ''))
+
+        # Only the latest snapshot is kept - compare against it, then replace it.
+        if self.trace:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            if self.snapshot is not None:
+                for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]:
+                    logging.info('Memory growth: ' + str(stat))
+            self.snapshot = snapshot
+
+        return self.budget_mb is not None and rss is not None and rss > self.budget_mb
+
+
+# Soft restart - drop the authenticated clients and caches, and collect garbage.  The next cycle authenticates afresh.
+def soft_restart(sync=None):
+    logging.warning('Over memory budget - soft restarting bot clients and caches.')
+    with sync.bot_lock if sync is not None else contextlib.nullcontext():
+        if sync is not None and sync.bot is not None:
+            sync.bot.release()
+            sync.bot = None
+        Job.parse_cache.clear()
+        TimezoneResolver.resolved.clear()
+    gc.collect()
+    logging.info('Memory after soft restart: RSS ' + str(MemoryMonitor.rss_mb()) + ' MB')
+
+
+# Run one bot cycle: reconcile reddit with the calendar, then persist the parse cache.  If there's a sync server, the
+# cycle's bot is handed over to it for on-demand syncs.
+def run_cycle(config_directory, feed=None, sync=None, outbox=None, listing_state=None, cleanup_schedule=None):
+    bot = CalendarBot(feed=feed, outbox=outbox, listing_state=listing_state, cleanup_schedule=cleanup_schedule)
+    with sync.bot_lock if sync is not None else contextlib.nullcontext():
+        try:
+            with log_duration('cycle', level=logging.INFO):
+                bot.run(config_directory)
+        except Exception as e:
+            logging.exception('bot error')
+        if sync is not None:
+            sync.bot = bot
+
+        # persist parse results
+        logging.info('Parse cache: ' + str(Job.parse_cache.stats()))
+        Job.parse_cache.save()
+
+
+# Parse titles (no reddit or google access) and report what we make of them.  Returns the number of failures.
+def check_titles(titles):
+    failures = 0
+    for title in titles:
+        try:
+            job = Job(title)
+            print(title + ' -> ' + repr([job.metaplot, job.name_of_run, job.get_start_datetime().isoformat(),
+                                         job.timezone]))
+        except Exception as e:
+            print(title + ' -> FAILED: ' + str(e))
+            failures += 1
+    return failures
+
+
+# Offline validation - read exported posts (JSONL or CSV, with id/title/selftext fields) in chunks of posts.  A row
+# that can't be read becomes a post carrying the error, so it's reported rather than ending the run.
+def read_post_export(filename, chunk_size):
+    with open(filename, 'r', encoding='utf-8', newline='') as export_file:
+        if filename.lower().endswith('.csv'):
+            rows = read_csv_rows(export_file)
+        else:
+            rows = read_jsonl_rows(export_file)
+
+        chunk = []
+        for row, error in rows:
+            if error is not None:
+                chunk.append((None, '', '', error))
+            else:
+                chunk.append((row.get('id'), row.get('title') or '', row.get('selftext') or ''))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# (row, error) for each line of a JSONL export.
+def read_jsonl_rows(export_file):
+    for line_number, line in enumerate(export_file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield None, 'Unreadable row: line ' + str(line_number) + ': ' + str(e)
+            continue
+        if isinstance(row, dict):
+            yield row, None
+        else:
+            yield None, 'Unreadable row: line ' + str(line_number) + ': not an object'
+
+
+# (row, error) for each row of a CSV export.
+def read_csv_rows(export_file):
+    import csv
+
+    # post bodies can be big.
+    csv.field_size_limit(max(csv.field_size_limit(), 16 * 1024 * 1024))
+    rows = csv.DictReader(export_file)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield None, 'Unreadable row: line ' + str(rows.line_num) + ': ' + str(e)
+            continue
+        yield row, None
+
+
+# Run a chunk of exported posts through the parser.  Runs in a worker process.
+def validate_posts(posts):
+    results = []
+    for post_id, title, selftext, *error in posts:
+        result = {'id': post_id, 'title': title, 'ok': False, 'matched': None, 'fields': None, 'reason': None}
+        if error:
+            result['reason'] = error[0]
+            results.append(result)
+            continue
+        try:
+            source, parser, parsed = Job.parse_explained(title, selftext)
+            result['matched'] = source + ':' + parser
+            result['fields'] = dict(zip(('metaplot', 'name_of_run', 'year', 'month', 'day', 'hour', 'minute',
+                                         'timezone'), parsed))
+
+            # parsed, but is it a real date/time?
+            metaplot, name_of_run, year, month, day, hour, minute, tz = parsed
+            datetime.datetime(year, month, day, hour, minute)
+            result['ok'] = True
+        except ValueError as e:
+            result['reason'] = 'Invalid date/time: ' + str(e)
+        except Exception as e:
+            result['reason'] = str(e)
+        results.append(result)
+    return results
+
+
+# Validate an export of posts across a process pool, writing per-post results (JSONL) to output_filename.  Only a few
+# chunks are in flight at once, so memory stays bounded however big the export is.  Returns aggregate stats.
+def validate_export(filename, output_filename, workers=None, chunk_size=1000):
+    import concurrent.futures
+
+    workers = workers or os.cpu_count() or 1
+    stats = {'posts': 0, 'ok': 0, 'failed': 0, 'formats': collections.Counter(), 'failures': collections.Counter()}
+
+    def write_results(results):
+        for result in results:
+            output_file.write(json.dumps(result) + '\n')
+            stats['posts'] += 1
+            if result['ok']:
+                stats['ok'] += 1
+                stats['formats'][result['matched']] += 1
+            else:
+                stats['failed'] += 1
+                # aggregate on the reason, not the title that comes after it.
+                stats['failures'][result['reason'].split(':', 1)[0]] += 1
+
+    with open(output_filename, 'w', encoding='utf-8') as output_file, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in read_post_export(filename, chunk_size):
+            pending.append(executor.submit(validate_posts, chunk))
+            if len(pending) >= 2 * workers:
+                write_results(pending.popleft().result())
+        while pending:
+            write_results(pending.popleft().result())
+
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Neon Anarchy job calendar bot.')
+    parser.add_argument('config_directory', nargs='?', help='directory holding calendarbot.cfg and google tokens')
+    parser.add_argument('--once', action='store_true', help='run a single cycle and exit (for schedulers)')
+    parser.add_argument('--check-title', nargs='+', metavar='TITLE', help='parse the given titles and exit')
+    parser.add_argument('--validate-export', metavar='FILE',
+                        help='parse an export of posts (.jsonl or .csv with id/title/selftext) and exit')
+    parser.add_argument('--output', metavar='FILE', help='per-post results for --validate-export (JSONL)')
+    parser.add_argument('--workers', type=int, help='worker processes for --validate-export')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='posts per work unit for --validate-export')
+    args = parser.parse_args(argv)
+
+    # Title check - no configuration required.
+    if args.check_title:
+        return 1 if check_titles(args.check_title) else 0
+
+    # Export validation - no configuration required.
+    if args.validate_export:
+        output = args.output or args.validate_export + '.results.jsonl'
+        stats = validate_export(args.validate_export, output, workers=args.workers, chunk_size=args.chunk_size)
+        print(json.dumps(stats, indent=2))
+        logging.info('Per-post results written to: ' + output)
+        return 0
+
+    # Which configuration direction do we use?
+    if not args.config_directory:
         # Invalid command-line params.
         logging.error('Invalid command-line arguments!')
         for arg in sys.argv:
             logging.info('Arg=' + arg)
+        return 2
+
+    # grab the configuration directory
+    config_directory = args.config_directory
+    configure_logging(config_directory + '/calendarbot.cfg')
+    logging.info('Configuration directory = ' + config_directory)
+
+    # One bot at a time.  If one's already running, ask it to run a cycle now instead.
+    lock = RunLock(config_directory + '/calendarbot.lock', daemon=not args.once)
+    if not lock.acquire():
+        if lock.wake_owner():
+            logging.info('Bot already running (pid ' + str(lock.owner.get('pid')) + ') - woken to run a cycle now.')
+        else:
+            logging.info('Bot already running (pid ' + str(lock.owner.get('pid') if lock.owner else '?') +
+                         ') - exiting.')
+        return 0
+
+    try:
+        # Keep parse results warm across cycles and restarts.
+        Job.parse_cache = ParseCache(max_size=256, filename=config_directory + '/parsecache.json',
+                                     version=Job.PARSER_VERSION)
+        Job.parse_cache.load()
+
+        # Local event feed (if configured).
+        feed = EventFeed.from_file(config_directory + '/calendarbot.cfg')
+        if feed is not None:
+            feed.load()
+
+        # Failed writes, waiting to be retried.
+        outbox = Outbox.from_file(config_directory + '/calendarbot.cfg', config_directory + '/outbox.json')
+        outbox.load()
+
+        # Where we're up to in the subreddit.
+        listing_state = ListingState.from_file(config_directory + '/calendarbot.cfg',
+                                               config_directory + '/listingstate.json')
+        listing_state.load()
+
+        # Rolling orphan cleanup.
+        cleanup_schedule = CleanupSchedule.from_file(config_directory + '/calendarbot.cfg',
+                                                     config_directory + '/cleanup.json')
+        cleanup_schedule.load()
+
+        # One-shot.
+        if args.once:
+            run_cycle(config_directory, feed, outbox=outbox, listing_state=listing_state,
+                      cleanup_schedule=cleanup_schedule)
+            return 0
+
+        # On-demand sync endpoint (if configured).
+        sync = SyncServer.from_file(config_directory + '/calendarbot.cfg')
+        if sync is not None:
+            sync.start()
+
+        # Keep an eye on memory use.
+        monitor = MemoryMonitor.from_file(config_directory + '/calendarbot.cfg')
+        monitor.start()
+
+        # Loop while running.
+        while True:
+            run_cycle(config_directory, feed, sync, outbox, listing_state, cleanup_schedule)
+            if monitor.sample():
+                soft_restart(sync)
+
+            # go back to sleep for a few minutes
+            seconds = (5 * 60)
+            logging.info("Sleeping for " + str(seconds) + " seconds.")
+            if not lock.wait(seconds):
+                logging.error('Lost run lock - exiting.')
+                return 1
+    finally:
+        lock.release()
+
+
+# Bot main loop
+if __name__ == '__main__':
+    sys.exit(main())
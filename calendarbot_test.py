@@ -1,12 +1,21 @@
 import datetime
+import json
+import logging
+import os
+import tempfile
+import time
 import unittest
+import urllib.request
 
-from calendarbot import RedditClient, GoogleClient, Job
+from calendarbot import RedditClient, GoogleClient, CalendarBot, CleanupSchedule, EventFeed, Job, ListingState, \
+    MemoryMonitor, Outbox, ParseCache, TimezoneResolver, RunLock, SyncServer, JsonFormatter, LOG_SAMPLE_RATES, \
+    log_event, soft_restart, validate_posts, validate_export
 
 # Test selectors for partial test runs
 TEST_REDDIT = False
 TEST_GOOGLE = False
 TEST_PARSING = True
+TEST_LOCAL = True
 
 
 class RedditTestCase(unittest.TestCase):
@@ -294,5 +303,898 @@ MoreBlahblah!""",
         self.assertIsNotNone(events)
 
 
+class JobTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_job_derived_fields(self):
+        job = Job('The Prince of the West. 22-01-2022 @ 1800 UTC-0600', post_id='abc', author='fredbear',
+                  selftext='Long post body...', permalink='/test')
+
+        # selftext isn't kept once parsed
+        self.assertFalse(hasattr(job, 'selftext'))
+        self.assertFalse(hasattr(job, '__dict__'))
+
+        # start date/time is computed once
+        self.assertIs(job.get_start_datetime(), job.get_start_datetime())
+        self.assertEqual(job.get_utc_offset(), datetime.timedelta(hours=-6))
+
+        # fingerprint tracks anything that ends up in the calendar event - including bot config
+        client = GoogleClient('calendar', 'public url', 'docs url', 'creator', 'subreddit', 'Subreddit')
+
+        def fingerprint_of(job):
+            return client.build_event_json(job)['extendedProperties']['private']['jobFingerprint']
+
+        fingerprint = fingerprint_of(job)
+        self.assertEqual(fingerprint, fingerprint_of(job))
+        job.flair = 'Job Closed'
+        self.assertNotEqual(fingerprint, fingerprint_of(job))
+        job.flair = None
+        client.creator = 'another creator'
+        self.assertNotEqual(fingerprint, fingerprint_of(job))
+
+
+class ParseCacheTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_hits_and_misses(self):
+        cache = ParseCache(max_size=10)
+        title = 'Name of Run. 2021-04-01. 1234 UTC'
+        first = cache.parse(title, None, Job.parse)
+        second = cache.parse(title, None, Job.parse)
+        self.assertEqual(first, second)
+        self.assertEqual(first, Job.parse_title(title))
+        self.assertEqual([cache.hits, cache.misses], [1, 1])
+
+        # hint in the selftext is a different key
+        cache.parse(title, '{CALENDAR_HINT: Other Run. 2021-04-02. 1234 UTC}', Job.parse)
+        self.assertEqual([cache.hits, cache.misses], [1, 2])
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_failures_cached(self):
+        cache = ParseCache(max_size=10)
+        for i in range(2):
+            with self.assertRaises(Exception):
+                cache.parse('This is complete crap.', 'No hint here.', Job.parse)
+        self.assertEqual([cache.hits, cache.misses], [1, 1])
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_size_bound(self):
+        cache = ParseCache(max_size=2)
+        cache.parse('Run A. 2021-04-01. 1234 UTC', None, Job.parse)
+        cache.parse('Run B. 2021-04-01. 1234 UTC', None, Job.parse)
+        cache.parse('Run A. 2021-04-01. 1234 UTC', None, Job.parse)
+        cache.parse('Run C. 2021-04-01. 1234 UTC', None, Job.parse)
+        self.assertEqual(len(cache.entries), 2)
+
+        # B was least recently used, so it's gone - A is not.
+        cache.parse('Run A. 2021-04-01. 1234 UTC', None, Job.parse)
+        cache.parse('Run B. 2021-04-01. 1234 UTC', None, Job.parse)
+        self.assertEqual([cache.hits, cache.misses], [2, 4])
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'parsecache.json')
+            cache = ParseCache(filename=filename)
+            parsed = cache.parse('Run A. 2021-04-01. 1234 UTC', None, Job.parse)
+            try:
+                cache.parse('This is complete crap.', None, Job.parse)
+            except Exception:
+                pass
+            cache.save()
+
+            warm = ParseCache(filename=filename)
+            warm.load()
+            self.assertEqual(warm.parse('Run A. 2021-04-01. 1234 UTC', None, Job.parse), parsed)
+            with self.assertRaises(Exception):
+                warm.parse('This is complete crap.', None, Job.parse)
+            self.assertEqual([warm.hits, warm.misses], [2, 0])
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_version_mismatch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'parsecache.json')
+            cache = ParseCache(filename=filename, version=1)
+            cache.parse('Run A. 2021-04-01. 1234 UTC', None, Job.parse)
+            cache.save()
+
+            upgraded = ParseCache(filename=filename, version=2)
+            upgraded.load()
+            self.assertEqual(len(upgraded.entries), 0)
+            self.assertFalse(os.path.exists(filename))
+
+
+class TimezoneResolverTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_offsets(self):
+        self.assertEqual(TimezoneResolver.resolve('UTC+10').google_name, 'Etc/GMT-10')
+        self.assertEqual(TimezoneResolver.resolve('UTC-6').google_name, 'Etc/GMT+6')
+        self.assertEqual(TimezoneResolver.resolve('UTC+0').google_name, 'UTC')
+
+        # no Etc zone for half-hour offsets
+        resolved = TimezoneResolver.resolve('UTC+05:30')
+        self.assertEqual(resolved.google_name, 'UTC')
+        self.assertEqual(resolved.tzinfo.utcoffset(None), datetime.timedelta(hours=5, minutes=30))
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_named(self):
+        self.assertEqual(TimezoneResolver.resolve('UTC').google_name, 'UTC')
+        self.assertEqual(TimezoneResolver.resolve('gmt').google_name, 'UTC')
+        self.assertEqual(TimezoneResolver.resolve('EST').google_name, 'America/New_York')
+        self.assertEqual(TimezoneResolver.resolve('Australia/Sydney').google_name, 'Australia/Sydney')
+
+        # unknown - UTC
+        self.assertFalse(TimezoneResolver.is_known('hrs'))
+        self.assertEqual(TimezoneResolver.resolve('Nowhere/Special').google_name, 'UTC')
+
+        # memoized
+        self.assertIs(TimezoneResolver.resolve('EST'), TimezoneResolver.resolve('EST'))
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_job_timezones(self):
+        # daylight savings applies to IANA timezones
+        job = Job('Name of Run. 2022-01-22. 1800 Australia/Sydney')
+        self.assertEqual(int(job.get_start_datetime().timestamp()), 1642834800)
+        job = Job('Name of Run. 2022-07-22. 1800 EST')
+        self.assertEqual(job.get_utc_offset(), datetime.timedelta(hours=-4))
+
+        # Google gets a normalised timezone name
+        client = GoogleClient('calendar', 'public', 'docs', 'creator', 'subreddit', 'Subreddit')
+        job = Job('Name of Run. 2022-01-22. 1800 UTC+10', post_id='abc', author='fredbear', permalink='/test')
+        event_json = client.build_event_json(job)
+        self.assertEqual(event_json['start'], {'dateTime': '2022-01-22T18:00:00', 'timeZone': 'Etc/GMT-10'})
+
+        job = Job('Name of Run. 2022-01-22. 1800 UTC+05:30', post_id='abc', author='fredbear', permalink='/test')
+        event_json = client.build_event_json(job)
+        self.assertEqual(event_json['start'], {'dateTime': '2022-01-22T12:30:00', 'timeZone': 'UTC'})
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_unknown_warned_once(self):
+        with self.assertLogs(level=logging.WARNING) as logs:
+            for i in range(3):
+                self.assertEqual(TimezoneResolver.resolve('UTC+99'), TimezoneResolver.UTC)
+        self.assertEqual(len(logs.records), 1)
+
+        # probing title words isn't worth a warning.
+        self.assertFalse(TimezoneResolver.is_known('Sequel'))
+
+
+class ValidateExportTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_validate_posts(self):
+        results = validate_posts([
+            ('a', 'Name of Run. 2021-04-01. 1234 UTC', ''),
+            ('b', 'CRAPCRAPCRAP', '{CALENDAR_HINT: The Prince of the West. 22-01-2022 @ 1800 UTC}'),
+            ('c', 'This is complete crap.', ''),
+            ('d', 'The Prince of the West. 01-22-2022 @ 1800 UTC', ''),
+        ])
+        self.assertEqual([result['matched'] for result in results],
+                         ['title:yyyy-mm-dd', 'hint:dd-mm-yyyy', None, 'title:dd-mm-yyyy'])
+        self.assertEqual([result['ok'] for result in results], [True, True, False, False])
+        self.assertEqual(results[0]['fields']['name_of_run'], 'Name of Run.')
+        self.assertTrue(results[2]['reason'].startswith('Unable to parse time/date in title'))
+        self.assertTrue(results[3]['reason'].startswith('Invalid date/time'))
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_validate_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            export = os.path.join(directory, 'posts.csv')
+            with open(export, 'w') as export_file:
+                export_file.write('id,title,selftext\n')
+                export_file.write('a,Name of Run. 2021-04-01. 1234 UTC,\n')
+                export_file.write('b,This is complete crap.,"multi\nline"\n')
+                export_file.write('c,Deacon Denied Redux 20220711 2359 UTC,\n')
+
+            output = os.path.join(directory, 'results.jsonl')
+            stats = validate_export(export, output, workers=1, chunk_size=2)
+            self.assertEqual([stats['posts'], stats['ok'], stats['failed']], [3, 2, 1])
+            self.assertEqual(stats['formats'], {'title:yyyy-mm-dd': 1, 'title:yyyymmdd': 1})
+
+            with open(output) as output_file:
+                self.assertEqual([json.loads(line)['id'] for line in output_file], ['a', 'b', 'c'])
+
+    @unittest.skipUnless(TEST_PARSING, "don't bother with parsing")
+    def test_unreadable_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            export = os.path.join(directory, 'posts.jsonl')
+            with open(export, 'w') as export_file:
+                export_file.write(json.dumps({'id': 'a', 'title': 'Name of Run. 2021-04-01. 1234 UTC'}) + '\n')
+                export_file.write('{"id": "b", "title": \n')
+                export_file.write('["not", "an", "object"]\n')
+                export_file.write(json.dumps({'id': 'c', 'title': 'Deacon Denied Redux 20220711 2359 UTC'}) + '\n')
+
+            output = os.path.join(directory, 'results.jsonl')
+            stats = validate_export(export, output, workers=1, chunk_size=2)
+            self.assertEqual([stats['posts'], stats['ok'], stats['failed']], [4, 2, 2])
+            self.assertEqual(stats['failures'], {'Unreadable row': 2})
+
+            with open(output) as output_file:
+                reasons = [json.loads(line)['reason'] for line in output_file]
+            self.assertTrue(reasons[1].startswith('Unreadable row: line 2'))
+            self.assertTrue(reasons[2].startswith('Unreadable row: line 3'))
+
+
+class RunLockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'calendarbot.lock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_single_flight(self):
+        first = RunLock(self.filename, daemon=True)
+        self.assertTrue(first.acquire())
+
+        second = RunLock(self.filename)
+        self.assertFalse(second.acquire())
+        self.assertEqual(second.owner['pid'], os.getpid())
+        self.assertTrue(second.owner['daemon'])
+
+        first.release()
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertTrue(second.acquire())
+        second.release()
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_stale_takeover(self):
+        stale = RunLock(self.filename, stale_seconds=60)
+        self.assertTrue(stale.acquire())
+
+        # age the heartbeat
+        with open(self.filename, 'w') as lock_file:
+            json.dump({'pid': os.getpid(), 'daemon': True, 'heartbeat': time.time() - 120}, lock_file)
+
+        fresh = RunLock(self.filename, stale_seconds=60)
+        self.assertTrue(fresh.acquire())
+
+        # the old owner finds out on its next heartbeat
+        with open(self.filename, 'w') as lock_file:
+            json.dump({'pid': -1, 'daemon': True, 'heartbeat': time.time()}, lock_file)
+        self.assertFalse(stale.heartbeat())
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_background_heartbeat(self):
+        heartbeat_seconds = RunLock.HEARTBEAT_SECONDS
+        RunLock.HEARTBEAT_SECONDS = 0.05
+        lock = RunLock(self.filename, stale_seconds=60)
+        try:
+            self.assertTrue(lock.acquire())
+
+            # a long cycle - no waiting between cycles, but the heartbeat keeps going.
+            with open(self.filename, 'w') as lock_file:
+                json.dump({'pid': os.getpid(), 'daemon': False, 'heartbeat': time.time() - 120}, lock_file)
+            time.sleep(0.5)
+            self.assertFalse(lock.is_stale(lock.read()))
+        finally:
+            RunLock.HEARTBEAT_SECONDS = heartbeat_seconds
+            lock.release()
+        self.assertFalse(os.path.exists(self.filename))
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_stale_guard(self):
+        lock = RunLock(self.filename)
+        with open(lock.guard_filename, 'w'):
+            pass
+        aged = time.time() - 2 * RunLock.GUARD_STALE_SECONDS
+        os.utime(lock.guard_filename, (aged, aged))
+
+        self.assertTrue(lock.acquire())
+        lock.release()
+        self.assertFalse(os.path.exists(lock.guard_filename))
+
+
+class EventFeedTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_feed(self):
+        client = GoogleClient('calendar', 'public', 'docs', 'creator', 'subreddit', 'Subreddit')
+        job = Job('[Metaplot] Name of Run, the sequel. 2099-04-01. 1234 UTC+10', post_id='abc', author='fredbear',
+                  permalink='/r/subreddit/comments/abc/', flair='Job Open')
+
+        with tempfile.TemporaryDirectory() as directory:
+            feed = EventFeed(os.path.join(directory, 'calendar.ics'), os.path.join(directory, 'calendar.json'))
+            feed.update(job, client.build_event_json(job))
+            feed.save()
+
+            with open(feed.ics_filename, newline='') as ics_file:
+                ics = ics_file.read().replace('\r\n ', '')
+            self.assertIn('DTSTART:20990401T023400Z\r\n', ics)
+            self.assertIn('SUMMARY:[JOB OPEN] [Metaplot] Name of Run\\, the sequel. 2099-04-01. 1234 UTC+10\r\n', ics)
+            with open(feed.json_filename) as json_file:
+                self.assertEqual([event['id'] for event in json.load(json_file)], ['abc'])
+
+            # no change - nothing to write
+            feed.update(job, client.build_event_json(job))
+            self.assertFalse(feed.dirty)
+
+            # state survives restarts
+            restarted = EventFeed(feed.ics_filename)
+            restarted.load()
+            self.assertEqual(list(restarted.entries), ['abc'])
+            restarted.remove('abc')
+            restarted.save()
+            with open(feed.ics_filename) as ics_file:
+                self.assertNotIn('BEGIN:VEVENT', ics_file.read())
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_seed_from_calendar(self):
+        client = GoogleClient('calendar', 'public', 'docs', 'creator', 'subreddit', 'Subreddit')
+        job = Job('Name of Run. 2099-04-01. 1234 UTC+10', post_id='abc', author='fredbear',
+                  permalink='/r/subreddit/comments/abc/', flair='Job Open')
+
+        # as Google lists it
+        event = client.build_event_json(job)
+        event['start'] = {'dateTime': '2099-04-01T12:34:00+10:00', 'timeZone': 'Etc/GMT-10'}
+        event['end'] = {'dateTime': '2099-04-01T15:34:00+10:00', 'timeZone': 'Etc/GMT-10'}
+
+        with tempfile.TemporaryDirectory() as directory:
+            feed = EventFeed(os.path.join(directory, 'calendar.ics'))
+            feed.update_from_event(event)
+            self.assertEqual(feed.entries['abc']['event']['start'], '2099-04-01T02:34:00+00:00')
+
+            # the same event, from the post - nothing to change.
+            feed.dirty = False
+            feed.update(job, client.build_event_json(job))
+            self.assertFalse(feed.dirty)
+            feed.update_from_event(event)
+            self.assertFalse(feed.dirty)
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_max_events(self):
+        client = GoogleClient('calendar', 'public', 'docs', 'creator', 'subreddit', 'Subreddit')
+        with tempfile.TemporaryDirectory() as directory:
+            feed = EventFeed(os.path.join(directory, 'calendar.ics'), max_events=2)
+            for day in range(1, 4):
+                job = Job('Name of Run. 2099-04-0' + str(day) + '. 1234 UTC', post_id='day' + str(day),
+                          author='fredbear', permalink='/test')
+                feed.update(job, client.build_event_json(job))
+            feed.save()
+            self.assertEqual(sorted(feed.entries), ['day2', 'day3'])
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_fold(self):
+        line = 'DESCRIPTION:' + 'x' * 200
+        folded = EventFeed.fold(line).split('\r\n')
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in folded))
+        self.assertEqual(folded[0] + ''.join(part[1:] for part in folded[1:]), line)
+
+
+class SyncServerTestCase(unittest.TestCase):
+
+    # Stands in for an authenticated CalendarBot.
+    class RecordingBot:
+        redditService = googleService = object()
+
+        def __init__(self):
+            self.synced = []
+
+        def process_post(self, post_id):
+            self.synced.append(post_id)
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_sync_requests(self):
+        server = SyncServer(port=0)
+        server.start()
+        try:
+            url = 'http://127.0.0.1:' + str(server.server.server_address[1])
+            bot = SyncServerTestCase.RecordingBot()
+
+            # hold the bot (as a cycle would) - repeat requests for a waiting post are coalesced.
+            with server.bot_lock:
+                server.bot = bot
+                responses = [json.load(urllib.request.urlopen(urllib.request.Request(url + '/sync/' + post_id,
+                                                                                     method='POST')))
+                             for post_id in ['abc', 'abc', 't3_def']]
+            self.assertEqual([response['queued'] for response in responses], [True, False, True])
+
+            for i in range(50):
+                if len(bot.synced) == 2:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(bot.synced, ['abc', 'def'])
+
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(urllib.request.Request(url + '/sync/not-a-post-id!', method='POST'))
+
+            # request logs are structured (and only built when DEBUG is on).
+            logger = logging.getLogger()
+            level = logger.level
+            logger.setLevel(logging.DEBUG)
+            try:
+                with self.assertLogs(level=logging.DEBUG) as logs:
+                    with server.bot_lock:
+                        urllib.request.urlopen(urllib.request.Request(url + '/sync/ghi', method='POST'))
+            finally:
+                logger.setLevel(level)
+            requests = [record.msg for record in logs.records if getattr(record.msg, 'event', None) == 'sync.request']
+            self.assertEqual(requests[0].fields['status'], 202)
+
+            # no GETs - a web page could send those.
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url + '/sync/abc')
+            self.assertEqual(context.exception.code, 405)
+        finally:
+            server.stop()
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_token(self):
+        server = SyncServer(port=0, token='secret')
+        server.start()
+        try:
+            url = 'http://127.0.0.1:' + str(server.server.server_address[1]) + '/sync/abc'
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(urllib.request.Request(url, method='POST'))
+            self.assertEqual(context.exception.code, 401)
+
+            with server.bot_lock:
+                response = json.load(urllib.request.urlopen(urllib.request.Request(
+                    url, method='POST', headers={'Authorization': 'Bearer secret'})))
+            self.assertTrue(response['queued'])
+        finally:
+            server.stop()
+
+        # listening beyond loopback needs a token.
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'calendarbot.cfg')
+            with open(filename, 'w') as config_file:
+                config_file.write('[Sync]\naddress = 0.0.0.0\nport = 8765\n')
+            self.assertIsNone(SyncServer.from_file(filename))
+            with open(filename, 'a') as config_file:
+                config_file.write('token = secret\n')
+            self.assertEqual(SyncServer.from_file(filename).token, 'secret')
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_foreign_post(self):
+        class Subreddit:
+            def __init__(self, display_name):
+                self.display_name = display_name
+
+        class Submission:
+            def __init__(self, post_id, subreddit):
+                self.id = post_id
+                self.subreddit = Subreddit(subreddit)
+
+        class RedditService:
+            def submission(self, id):
+                return Submission(id, 'Subreddit' if id == 'ours' else 'elsewhere')
+
+        processed = []
+        bot = CalendarBot()
+        bot.redditClient = RedditClient('id', 'secret', 'bot', 'password', 'agent', 'link', 'subreddit', 'Subreddit')
+        bot.redditService = RedditService()
+        bot.process_submission = lambda submission: processed.append(submission.id)
+        bot.process_post('theirs')
+        bot.process_post('ours')
+        self.assertEqual(processed, ['ours'])
+
+
+class MemoryMonitorTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), "RSS only available on linux")
+    def test_budget(self):
+        self.assertGreater(MemoryMonitor.rss_mb(), 0)
+        self.assertFalse(MemoryMonitor().sample())
+        self.assertFalse(MemoryMonitor(budget_mb=1024 * 1024).sample())
+        self.assertTrue(MemoryMonitor(budget_mb=1).sample())
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_soft_restart(self):
+        class ReleasingBot:
+            released = False
+
+            def release(self):
+                self.released = True
+
+        bot = ReleasingBot()
+        sync = SyncServer()
+        sync.bot = bot
+        Job('Name of Run. 2021-04-01. 1234 UTC')
+        self.assertGreater(len(Job.parse_cache.entries), 0)
+
+        soft_restart(sync)
+        self.assertTrue(bot.released)
+        self.assertIsNone(sync.bot)
+        self.assertEqual(len(Job.parse_cache.entries), 0)
+
+        # and without a sync server
+        soft_restart()
+
+
+class OutboxTestCase(unittest.TestCase):
+
+    # Stands in for GoogleClient - fails the first write.
+    class FlakyGoogleClient:
+        def __init__(self):
+            self.writes = []
+
+        def write_event(self, post_id, body, event_id=None):
+            self.writes.append(post_id)
+            if len(self.writes) == 1:
+                raise Exception('backend error')
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_keys_and_backoff(self):
+        outbox = Outbox(max_attempts=2, backoff_seconds=60)
+        outbox.add('event.write', 'abc', {'body': {'summary': 'old'}})
+        outbox.add('event.write', 'abc', {'body': {'summary': 'new'}})
+        outbox.add('comment.post', 'abc', {'text': 'hi'})
+        self.assertEqual(list(outbox.entries), ['event:abc', 'comment:abc'])
+        self.assertEqual(outbox.entries['event:abc']['payload']['body']['summary'], 'new')
+
+        # a delete replaces a pending write
+        outbox.add('event.delete', 'abc')
+        self.assertEqual(outbox.entries['event:abc']['op'], 'event.delete')
+
+        # failures back off, then give up
+        entry = outbox.due(time.time())['Google'][0]
+        outbox.failed(entry, Exception('nope'))
+        self.assertEqual(outbox.due(time.time()), {'Reddit': [outbox.entries['comment:abc']]})
+        self.assertEqual(outbox.due(time.time() + 61)['Google'][0]['attempts'], 1)
+        outbox.failed(entry, Exception('nope'))
+        self.assertEqual(list(outbox.entries), ['comment:abc'])
+
+        # success doesn't remove a newer write for the same key
+        entry = outbox.due(time.time())['Reddit'][0]
+        outbox.add('comment.post', 'abc', {'text': 'newer'})
+        outbox.succeeded(entry)
+        self.assertEqual(outbox.entries['comment:abc']['payload']['text'], 'newer')
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_drain(self):
+        with tempfile.TemporaryDirectory() as directory:
+            outbox = Outbox(os.path.join(directory, 'outbox.json'), backoff_seconds=0)
+            outbox.add('event.write', 'abc', {'body': {}, 'comment': 'posted!'})
+
+            bot = CalendarBot(outbox=outbox)
+            bot.googleClient = OutboxTestCase.FlakyGoogleClient()
+            bot.drain_outbox()
+            self.assertEqual(outbox.entries['event:abc']['attempts'], 1)
+
+            # survives a restart, and retries
+            restarted = Outbox(outbox.filename)
+            restarted.load()
+            bot.outbox = restarted
+            bot.drain_outbox()
+            self.assertEqual(bot.googleClient.writes, ['abc', 'abc'])
+
+            # written - the notification comment is queued next.
+            self.assertEqual(list(restarted.entries), ['comment:abc'])
+
+
+class ListingStateTestCase(unittest.TestCase):
+
+    class FakeSubmission:
+        def __init__(self, post_id, created_utc, edited=False, flair='Job Open'):
+            self.id = post_id
+            self.fullname = 't3_' + post_id
+            self.created_utc = created_utc
+            self.edited = edited
+            self.link_flair_text = flair
+
+    # Stands in for praw's Subreddit (and Reddit) - posts newest first.
+    class FakeSubreddit:
+        def __init__(self, posts, moderator):
+            self.posts = posts
+            self.moderator = moderator
+            self.mod = self
+
+        def subreddit(self, name):
+            return self
+
+        def new(self, limit, params=None):
+            posts = self.posts
+            if params and params.get('before'):
+                posts = posts[:[post.fullname for post in posts].index(params['before'])]
+            return posts[:limit]
+
+        def edited(self, only, limit):
+            if not self.moderator:
+                raise Exception('403 Forbidden')
+            return sorted([post for post in self.posts if post.edited], key=lambda post: -post.edited)[:limit]
+
+        def info(self, fullnames):
+            return [post for post in self.posts if post.fullname in fullnames]
+
+    def fetch(self, reddit, listing_state):
+        client = RedditClient('id', 'secret', 'bot', 'password', 'agent', 'link', 'subreddit', 'Subreddit')
+        submissions = client.get_submissions(reddit, listing_state)
+        for submission in submissions:
+            listing_state.saw(submission)
+        listing_state.commit()
+        return [submission.id for submission in submissions]
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_delta(self):
+        now = time.time()
+        for moderator in (True, False):
+            posts = [ListingStateTestCase.FakeSubmission('p' + str(i), now - i * 60) for i in range(30)]
+            reddit = ListingStateTestCase.FakeSubreddit(posts, moderator)
+            posts[25].edited = now - 120
+
+            listing_state = ListingState()
+            self.assertEqual(len(self.fetch(reddit, listing_state)), 20)
+            self.assertEqual(listing_state.newest, 't3_p0')
+
+            # nothing new
+            self.assertEqual(self.fetch(reddit, listing_state), [])
+
+            # a new post, and an edit well down the listing
+            posts.insert(0, ListingStateTestCase.FakeSubmission('new', now + 60))
+            posts[10].edited = now
+            self.assertEqual(self.fetch(reddit, listing_state), ['new', 'p9'])
+            self.assertEqual(listing_state.moderator, moderator)
+
+            # and nothing after that
+            self.assertEqual(self.fetch(reddit, listing_state), [])
+
+            # flair changes aren't edits - but they're picked up too.
+            posts[5].link_flair_text = 'Job Closed'
+            self.assertEqual(self.fetch(reddit, listing_state), ['p4'])
+            self.assertEqual(self.fetch(reddit, listing_state), [])
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_bad_post(self):
+        now = time.time()
+        posts = [ListingStateTestCase.FakeSubmission('p' + str(i), now - i * 60) for i in range(5)]
+        processed = []
+
+        def process_submission(submission):
+            if submission.id == 'p2':
+                raise Exception('bad post')
+            processed.append(submission.id)
+
+        bot = CalendarBot(listing_state=ListingState())
+        bot.redditClient = RedditClient('id', 'secret', 'bot', 'password', 'agent', 'link', 'subreddit', 'Subreddit')
+        bot.redditService = ListingStateTestCase.FakeSubreddit(posts, True)
+        bot.process_submission = process_submission
+        bot.process_reddit_submissions()
+
+        # the posts after it still go through, and the next cycle carries on from the newest.
+        self.assertEqual(processed, ['p4', 'p3', 'p1', 'p0'])
+        self.assertEqual(bot.listing_state.newest, 't3_p0')
+
+        posts.insert(0, ListingStateTestCase.FakeSubmission('new', now + 60))
+        bot.process_reddit_submissions()
+        self.assertEqual(processed[-1], 'new')
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_unfinished_edits(self):
+        now = time.time()
+        posts = [ListingStateTestCase.FakeSubmission('p' + str(i), now - i * 60) for i in range(5)]
+        reddit = ListingStateTestCase.FakeSubreddit(posts, True)
+        posts[4].edited = now - 120
+        listing_state = ListingState()
+        self.fetch(reddit, listing_state)
+
+        # an edit is read, but the cycle stops before it's processed - so it's read again.
+        posts[3].edited = now
+        client = RedditClient('id', 'secret', 'bot', 'password', 'agent', 'link', 'subreddit', 'Subreddit')
+        self.assertEqual([submission.id for submission in client.get_submissions(reddit, listing_state)], ['p3'])
+        self.assertEqual(self.fetch(reddit, listing_state), ['p3'])
+        self.assertEqual(self.fetch(reddit, listing_state), [])
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_error_comments(self):
+        class Author:
+            name = 'fredbear'
+
+        posts = [ListingStateTestCase.FakeSubmission('bad', time.time()),
+                 ListingStateTestCase.FakeSubmission('deleted', time.time())]
+        for post in posts:
+            post.title = 'No date in this title'
+            post.selftext = post.url = post.permalink = ''
+        posts[0].author = Author()
+        posts[1].author = None
+
+        comments = []
+        bot = CalendarBot()
+        bot.redditClient = RedditClient('id', 'secret', 'bot', 'password', 'agent', 'link', 'subreddit', 'Subreddit')
+        bot.googleClient = GoogleClient('calendar', 'public url', 'docs url', 'creator', 'subreddit', 'Subreddit')
+        bot.post_comment = lambda submission, text: comments.append(text)
+        for post in posts:
+            bot.process_submission(post)
+
+        self.assertTrue(comments[0].startswith('Hi /u/fredbear!'))
+        self.assertIn('{CALENDAR_HINT: [Metaplot, if any] Name of Run. 2021-08-16. 2300 UTC}', comments[0])
+        self.assertTrue(comments[1].startswith('Hi there!'))
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            listing_state = ListingState(os.path.join(directory, 'listingstate.json'), max_tracked=2)
+            for i in range(3):
+                listing_state.saw(ListingStateTestCase.FakeSubmission('p' + str(i), time.time() - i))
+            listing_state.save()
+
+            listing_state.cycles = 5
+            listing_state.save()
+
+            restarted = ListingState(listing_state.filename)
+            restarted.load()
+            self.assertEqual(restarted.newest, 't3_p0')
+            self.assertEqual(sorted(restarted.tracked), ['p0', 'p1'])
+
+            # a fresh process (eg. --once) carries on with delta reads, rather than starting with a full scan.
+            self.assertEqual(restarted.cycles, 5)
+            self.assertFalse(restarted.needs_full_scan())
+
+
+class CleanupScheduleTestCase(unittest.TestCase):
+
+    # Stands in for GoogleClient - serves the calendar's changes since the last sync.
+    class SyncingGoogleClient:
+        def __init__(self):
+            self.changes = []
+            self.syncs = []
+
+        def sync_events(self, sync_token=None):
+            self.syncs.append(sync_token)
+            changes, self.changes = self.changes, []
+            return changes, 'token' + str(len(self.syncs)), sync_token is None
+
+    @staticmethod
+    def event(post_id, start):
+        return {'id': 'event-' + post_id, 'summary': post_id,
+                'start': {'dateTime': datetime.datetime.fromtimestamp(start, datetime.timezone.utc).isoformat()},
+                'extendedProperties': {'private': {'redditPost': post_id}}}
+
+    @staticmethod
+    def post_ids(events):
+        return [event['extendedProperties']['private']['redditPost'] for event in events]
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_index(self):
+        now = time.time()
+        client = CleanupScheduleTestCase.SyncingGoogleClient()
+        schedule = CleanupSchedule()
+
+        client.changes = [CleanupScheduleTestCase.event('a', now + 3600),
+                          CleanupScheduleTestCase.event('b', now + 7200),
+                          {'id': 'not-ours', 'start': {'dateTime': '2099-01-01T00:00:00Z'}}]
+        self.assertEqual(len(schedule.refresh(client)), 2)
+        self.assertEqual(sorted(schedule.events), ['event-a', 'event-b'])
+
+        # after that, only changes are read.
+        client.changes = [{'id': 'event-a', 'status': 'cancelled'}]
+        self.assertEqual(schedule.refresh(client), [])
+        self.assertEqual(client.syncs, [None, 'token1'])
+        self.assertEqual(sorted(schedule.events), ['event-b'])
+
+        schedule.forget('b')
+        self.assertEqual(schedule.events, {})
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_rolling(self):
+        now = time.time()
+        hour = 60 * 60
+        schedule = CleanupSchedule(per_cycle=3, full_pass_hours=24, min_interval_minutes=15)
+        for i in range(7):
+            event = CleanupScheduleTestCase.event('p' + str(i), now + (i + 1) * 24 * hour)
+            schedule.events[event['id']] = event
+        soon = CleanupScheduleTestCase.event('soon', now + hour)
+        schedule.events[soon['id']] = soon
+
+        # a bounded slice each cycle, soonest first - and every event checked within a pass.
+        checked = []
+        for cycle in range(3):
+            selected = CleanupScheduleTestCase.post_ids(schedule.select(now))
+            self.assertLessEqual(len(selected), 3)
+            for post_id in selected:
+                schedule.mark_verified(post_id, now)
+            checked.extend(selected)
+        self.assertEqual(checked[0], 'soon')
+        self.assertEqual(sorted(checked), sorted(['soon'] + ['p' + str(i) for i in range(7)]))
+        self.assertEqual(schedule.select(now), [])
+
+        # 20 minutes on, only the imminent run is due again.
+        self.assertEqual(CleanupScheduleTestCase.post_ids(schedule.select(now + 20 * 60)), ['soon'])
+
+        # events that have started are dropped (and forgotten).
+        schedule.select(now + 2 * hour)
+        self.assertNotIn('event-soon', schedule.events)
+        self.assertNotIn('soon', schedule.last_verified)
+
+        # a day on (p0 has started), everything is due - and after a day without a cycle, the slice grows to catch up
+        # (up to max_per_cycle).
+        self.assertEqual(len(schedule.select(now + 26 * hour)), 6)
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_full_pass(self):
+        # a big calendar - per_cycle alone would take days to get round it.
+        now = time.time()
+        schedule = CleanupSchedule(per_cycle=1, full_pass_hours=24)
+        for i in range(1000):
+            event = CleanupScheduleTestCase.event('p' + str(i), now + 10 * 24 * 60 * 60 + i)
+            schedule.events[event['id']] = event
+
+        # a day of five minute cycles checks everything.
+        for cycle in range(24 * 12):
+            cycle_time = now + cycle * 5 * 60
+            for post_id in CleanupScheduleTestCase.post_ids(schedule.select(cycle_time)):
+                schedule.mark_verified(post_id, cycle_time)
+        self.assertEqual(len(schedule.last_verified), 1000)
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_max_per_cycle(self):
+        now = time.time()
+        schedule = CleanupSchedule(per_cycle=1, full_pass_hours=24, max_per_cycle=2)
+        for i in range(1000):
+            event = CleanupScheduleTestCase.event('p' + str(i), now + 10 * 24 * 60 * 60 + i)
+            schedule.events[event['id']] = event
+
+        # the slice stays bounded - and we're told the pass will overrun.
+        with self.assertLogs(level=logging.WARNING) as logs:
+            self.assertEqual(len(schedule.select(now)), 2)
+        self.assertIn('max_per_cycle', logs.output[0])
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            schedule = CleanupSchedule(os.path.join(directory, 'cleanup.json'))
+            schedule.refresh(CleanupScheduleTestCase.SyncingGoogleClient())
+            event = CleanupScheduleTestCase.event('abc', time.time() + 3600)
+            schedule.events[event['id']] = event
+            schedule.mark_verified('abc', 1000.0)
+            schedule.save()
+
+            restarted = CleanupSchedule(schedule.filename)
+            restarted.load()
+            self.assertEqual(restarted.sync_token, 'token1')
+            self.assertEqual(restarted.events, schedule.events)
+            self.assertEqual(restarted.last_verified, {'abc': 1000.0})
+
+
+class StructuredLoggingTestCase(unittest.TestCase):
+
+    # Counts how often it's turned into a string.
+    class Expensive:
+        def __init__(self):
+            self.formatted = 0
+
+        def __str__(self):
+            self.formatted += 1
+            return 'expensive'
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_lazy(self):
+        expensive = StructuredLoggingTestCase.Expensive()
+        logger = logging.getLogger()
+        level = logger.level
+        try:
+            logger.setLevel(logging.INFO)
+            log_event(logging.DEBUG, 'test.lazy', payload=expensive)
+            self.assertEqual(expensive.formatted, 0)
+
+            with self.assertLogs(level=logging.DEBUG) as logs:
+                log_event(logging.DEBUG, 'test.lazy', 'Message', post_id='abc', payload=expensive)
+            self.assertEqual(logs.output, ['DEBUG:root:Message [test.lazy] post_id=abc payload=expensive'])
+        finally:
+            logger.setLevel(level)
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_sampling(self):
+        LOG_SAMPLE_RATES['test.sampled'] = 0
+        try:
+            with self.assertLogs(level=logging.INFO) as logs:
+                log_event(logging.INFO, 'test.sampled')
+                log_event(logging.INFO, 'test.unsampled')
+            self.assertEqual(len(logs.records), 1)
+        finally:
+            del LOG_SAMPLE_RATES['test.sampled']
+
+    @unittest.skipUnless(TEST_LOCAL, "don't test local-only features")
+    def test_json(self):
+        with self.assertLogs(level=logging.INFO) as logs:
+            log_event(logging.INFO, 'google.insert', post_id='abc', duration=0.25)
+        entry = json.loads(JsonFormatter().format(logs.records[0]))
+        self.assertEqual([entry['event'], entry['post_id'], entry['duration']], ['google.insert', 'abc', 0.25])
+
+
 if __name__ == '__main__':
     unittest.main()